@@ -6,7 +6,7 @@ Loads environment variables with validation and defaults.
 from pydantic_settings import BaseSettings
 from pydantic import Field
 from typing import Literal
-from functools import lru_cache
+from functools import cache, cached_property
 
 
 class Settings(BaseSettings):
@@ -21,10 +21,25 @@ class Settings(BaseSettings):
         description="AI provider to use"
     )
     
+    max_concurrent_llm: int = Field(
+        default=8,
+        ge=1,
+        description="Maximum concurrent requests to the AI provider per worker"
+    )
+    
     # Server Configuration
     host: str = Field(default="0.0.0.0", description="Server host")
     port: int = Field(default=8000, description="Server port")
     debug: bool = Field(default=False, description="Debug mode")
+    enable_docs: bool = Field(
+        default=False,
+        description="Serve OpenAPI docs outside debug mode"
+    )
+    
+    max_upload_bytes: int = Field(
+        default=10 * 1024 * 1024,
+        description="Maximum accepted image upload size in bytes"
+    )
     
     # CORS Configuration
     cors_origins: str = Field(
@@ -32,16 +47,37 @@ class Settings(BaseSettings):
         description="Comma-separated CORS origins"
     )
     
+    # Cache Configuration
+    redis_url: str = Field(
+        default="",
+        description="Redis URL for the shared story cache (in-memory if empty)"
+    )
+    story_cache_ttl: int = Field(default=3600, description="Story cache TTL in seconds")
+    story_cache_max: int = Field(default=500, description="Maximum cached stories")
+    llm_cache_ttl: int = Field(
+        default=3600,
+        description="Story and quiz completion cache TTL in seconds"
+    )
+    image_cache_ttl: int = Field(
+        default=86400,
+        description="Image analysis cache TTL in seconds"
+    )
+    
     # TTS Configuration
     tts_voice: str = Field(default="en-US-AriaNeural", description="TTS voice")
     tts_rate: str = Field(default="+0%", description="TTS speech rate")
     tts_volume: str = Field(default="+0%", description="TTS volume")
     
-    @property
+    @cached_property
     def cors_origins_list(self) -> list[str]:
-        """Parse CORS origins string into a list."""
+        """Parse CORS origins string into a list (computed once)."""
         return [origin.strip() for origin in self.cors_origins.split(",")]
     
+    @property
+    def docs_enabled(self) -> bool:
+        """Whether the interactive API docs should be served."""
+        return self.debug or self.enable_docs
+    
     def get_api_key(self) -> str:
         """Get the appropriate API key based on provider."""
         if self.ai_provider == "openai":
@@ -56,7 +92,7 @@ class Settings(BaseSettings):
         case_sensitive = False
 
 
-@lru_cache()
+@cache
 def get_settings() -> Settings:
     """Cached settings instance."""
     return Settings()
@@ -6,16 +6,18 @@ curriculum-aligned stories from sketches, diagrams, and keywords.
 """
 
 import logging
+import sys
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request
+import orjson
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
 from config import get_settings
-from routers import input_router, story_router, audio_router
 from models.schemas import ErrorResponse
 
 # Configure logging
@@ -25,24 +27,72 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+settings = get_settings()
+
+# Directory for generated narration files
+AUDIO_DIR = (Path(__file__).parent / "audio_output").resolve()
+
+# Responses smaller than this are sent uncompressed
+GZIP_MINIMUM_SIZE = 1024
+
+
+class JSONCompressionMiddleware(GZipMiddleware):
+    """
+    GZip middleware that leaves audio and event streams uncompressed.
+    
+    MP3 data does not shrink, and buffering inside the compressor would
+    hold back streamed story tokens until the response ends.
+    """
+    
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] == "http" and (
+            path.startswith("/api/audio/") or path.endswith("/stream")
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager."""
     # Startup
     logger.info("Starting Multimodal Storytelling Platform...")
-    settings = get_settings()
-    logger.info(f"AI Provider: {settings.ai_provider}")
-    logger.info(f"Debug Mode: {settings.debug}")
+    logger.info("AI Provider: %s", settings.ai_provider)
+    logger.info("Debug Mode: %s", settings.debug)
     
     # Create audio output directory
-    audio_dir = Path(__file__).parent / "audio_output"
-    audio_dir.mkdir(exist_ok=True)
+    AUDIO_DIR.mkdir(exist_ok=True)
+    
+    # Build the shared singletons now so the first request does not pay
+    # for loading the curriculum or setting up speech synthesis
+    from models.curriculum import get_curriculum_kb
+    from services.cache import get_cache_service
+    from services.speech_service import get_speech_service
+    from utils.http_client import close_http_client
+    get_curriculum_kb()
+    get_speech_service()
+    cache_service = get_cache_service()
+    
+    # Import the configured provider SDK and create its clients at boot
+    # rather than inside the first story request
+    from services.ai_processor import get_ai_processor
+    from services.story_engine import get_story_engine
+    from services.quiz_generator import get_quiz_generator
+    try:
+        await get_ai_processor().warmup()
+        get_story_engine()
+        get_quiz_generator()
+    except Exception as e:
+        logger.warning("AI provider warm-up failed: %s", e)
     
     yield
     
     # Shutdown
     logger.info("Shutting down Multimodal Storytelling Platform...")
+    await cache_service.close()
+    await close_http_client()
 
 
 # Create FastAPI application
@@ -62,12 +112,13 @@ app = FastAPI(
     """,
     version="1.0.0",
     lifespan=lifespan,
-    docs_url="/docs",
-    redoc_url="/redoc"
+    default_response_class=ORJSONResponse,
+    docs_url="/docs" if settings.docs_enabled else None,
+    redoc_url="/redoc" if settings.docs_enabled else None,
+    openapi_url="/openapi.json" if settings.docs_enabled else None
 )
 
 # Configure CORS
-settings = get_settings()
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.cors_origins_list,
@@ -76,26 +127,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress story and quiz JSON
+app.add_middleware(
+    JSONCompressionMiddleware,
+    minimum_size=GZIP_MINIMUM_SIZE,
+    compresslevel=6
+)
+
 
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Handle uncaught exceptions."""
-    logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    logger.error("Unhandled exception: %s", exc, exc_info=True)
+    # Same shape as ErrorResponse, serialized directly without a model
+    return Response(
+        content=orjson.dumps({
+            "error": "InternalServerError",
+            "message": "An unexpected error occurred",
+            "details": {"path": str(request.url)}
+        }),
         status_code=500,
-        content=ErrorResponse(
-            error="InternalServerError",
-            message="An unexpected error occurred",
-            details={"path": str(request.url)}
-        ).model_dump()
+        media_type="application/json"
     )
 
 
+# Error responses documented once for every API route
+COMMON_ERROR_RESPONSES = {
+    400: {"model": ErrorResponse},
+    404: {"model": ErrorResponse},
+    500: {"model": ErrorResponse},
+}
+
+
+def _include_routers(app: FastAPI) -> None:
+    """Import and mount the API routers once the app exists."""
+    from routers.input_handler import router as input_router
+    from routers.story import router as story_router
+    from routers.audio import router as audio_router
+    
+    for router in (input_router, story_router, audio_router):
+        app.include_router(router, prefix="/api", responses=COMMON_ERROR_RESPONSES)
+
+
 # Include routers
-app.include_router(input_router, prefix="/api")
-app.include_router(story_router, prefix="/api")
-app.include_router(audio_router, prefix="/api")
+_include_routers(app)
 
 
 # Health check endpoint
@@ -121,7 +197,7 @@ async def api_info():
             "story": "/api/story",
             "audio": "/api/audio"
         },
-        "documentation": "/docs"
+        "documentation": app.docs_url
     }
 
 
@@ -131,7 +207,7 @@ async def root():
     """Root endpoint with welcome message."""
     return {
         "message": "Welcome to the Multimodal Storytelling Platform",
-        "documentation": "/docs",
+        "documentation": app.docs_url,
         "health": "/health"
     }
 
@@ -139,11 +215,14 @@ async def root():
 if __name__ == "__main__":
     import uvicorn
     
-    settings = get_settings()
     uvicorn.run(
         "main:app",
         host=settings.host,
         port=settings.port,
         reload=settings.debug,
+        # C event loop and HTTP parser (uvloop is not available on Windows)
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        access_log=settings.debug,
         log_level="info" if not settings.debug else "debug"
     )
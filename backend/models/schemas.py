@@ -3,13 +3,20 @@ Pydantic schemas for request/response validation.
 Provides strict type safety for all API endpoints.
 """
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import Optional, Literal
 from enum import Enum
-import base64
 import re
 
 
+# Base64 alphabet check used instead of decoding the whole payload
+_B64_RE = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+# Data URI headers accepted for uploaded images
+_IMAGE_DATA_URI_RE = re.compile(r"data:image/(?:png|jpeg|jpg|gif|webp);base64,")
+# Characters stripped from keyword input
+_KW_SANITIZE = re.compile(r"[<>{}\[\]\\]")
+
+
 class InputType(str, Enum):
     """Supported input types for the multimodal handler."""
     SKETCH = "sketch"
@@ -26,7 +33,7 @@ class StoryRequest(BaseModel):
     )
     image_data: Optional[str] = Field(
         default=None,
-        description="Base64-encoded image data for sketches/diagrams"
+        description="Base64-encoded image data or data URI for sketches/diagrams"
     )
     keywords: Optional[str] = Field(
         default=None,
@@ -42,41 +49,43 @@ class StoryRequest(BaseModel):
         description="Language code for the story",
         max_length=10
     )
+    include_audio: bool = Field(
+        default=False,
+        description="Also generate narration audio for the story"
+    )
     
     @field_validator("image_data")
     @classmethod
     def validate_image_data(cls, v: Optional[str]) -> Optional[str]:
-        """Validate that image data is valid base64."""
+        """Validate base64 image data and normalize it to a data URI."""
         if v is None:
             return v
         
-        # Remove data URI prefix if present
+        # Validate base64 format without decoding or slicing off the data
+        # URI prefix; the image is decoded once downstream where the bytes
+        # are actually needed
         if v.startswith("data:"):
-            # Extract base64 part after the comma
-            if "," in v:
-                v = v.split(",", 1)[1]
+            header = _IMAGE_DATA_URI_RE.match(v)
+            if header is None:
+                raise ValueError("Invalid image data URI")
+            start = header.end()
+        else:
+            start = 0
         
-        # Validate base64 format
-        try:
-            base64.b64decode(v, validate=True)
-        except Exception:
+        if len(v) == start:
+            raise ValueError("Image data is empty")
+        if (len(v) - start) % 4 or not _B64_RE.fullmatch(v, start):
             raise ValueError("Invalid base64 image data")
         
-        return v
-    
-    @field_validator("keywords")
-    @classmethod
-    def validate_keywords(cls, v: Optional[str]) -> Optional[str]:
-        """Sanitize and validate keywords."""
-        if v is None:
-            return v
-        
-        # Remove potentially dangerous characters
-        v = re.sub(r'[<>{}[\]\\]', '', v)
-        return v.strip()
+        # Bare base64 gets the prefix once here rather than per provider call
+        return v if start else f"data:image/png;base64,{v}"
     
     def model_post_init(self, __context) -> None:
-        """Validate that either image or keywords is provided."""
+        """Sanitize keywords and validate that either image or keywords is provided."""
+        # Remove potentially dangerous characters
+        if self.keywords:
+            self.keywords = _KW_SANITIZE.sub("", self.keywords).strip()
+        
         if self.input_type in [InputType.SKETCH, InputType.DIAGRAM]:
             if not self.image_data:
                 raise ValueError(
@@ -133,6 +142,10 @@ class ImageAnalysisResult(BaseModel):
 class QuizQuestion(BaseModel):
     """Model for a single quiz question."""
     
+    # Questions are never edited after parsing, which lets one instance be
+    # shared safely between quizzes
+    model_config = ConfigDict(frozen=True)
+    
     question: str = Field(..., description="The question text")
     options: list[str] = Field(
         ...,
@@ -168,6 +181,18 @@ class QuizResponse(BaseModel):
     )
 
 
+class AudioResponse(BaseModel):
+    """Response model for audio generation."""
+    
+    audio_id: str = Field(..., description="Unique audio identifier")
+    audio_url: str = Field(..., description="URL to access the audio")
+    duration_seconds: Optional[float] = Field(
+        default=None,
+        description="Audio duration in seconds"
+    )
+    format: str = Field(default="mp3", description="Audio format")
+
+
 class StoryResponse(BaseModel):
     """Response model for generated stories."""
     
@@ -189,6 +214,10 @@ class StoryResponse(BaseModel):
         default=False,
         description="Whether audio is available"
     )
+    audio: Optional[AudioResponse] = Field(
+        default=None,
+        description="Story narration, when requested"
+    )
 
 
 class AudioRequest(BaseModel):
@@ -214,18 +243,6 @@ class AudioRequest(BaseModel):
     )
 
 
-class AudioResponse(BaseModel):
-    """Response model for audio generation."""
-    
-    audio_id: str = Field(..., description="Unique audio identifier")
-    audio_url: str = Field(..., description="URL to access the audio")
-    duration_seconds: Optional[float] = Field(
-        default=None,
-        description="Audio duration in seconds"
-    )
-    format: str = Field(default="mp3", description="Audio format")
-
-
 class ErrorResponse(BaseModel):
     """Standard error response model."""
     
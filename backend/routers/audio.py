@@ -4,27 +4,35 @@ Handles audio generation and streaming.
 """
 
 import logging
+from email.utils import formatdate
 from pathlib import Path
 
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import FileResponse, StreamingResponse
+import aiofiles.os
+import anyio
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
-from models.schemas import AudioRequest, AudioResponse, ErrorResponse
-from services.speech_service import get_speech_service
+from models.schemas import AudioRequest, AudioResponse
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/audio", tags=["Speech Synthesis"])
 
+# Chunk size used when streaming stored audio files
+AUDIO_CHUNK_SIZE = 64 * 1024
 
-@router.post(
-    "/generate",
-    response_model=AudioResponse,
-    responses={
-        400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
-)
+# Audio files never change once written, so clients may cache them
+AUDIO_CACHE_CONTROL = "public, max-age=86400"
+
+
+async def _iter_file(path: Path, chunk_size: int = AUDIO_CHUNK_SIZE):
+    """Read a file asynchronously in fixed-size chunks."""
+    async with await anyio.open_file(path, "rb") as f:
+        while chunk := await f.read(chunk_size):
+            yield chunk
+
+
+@router.post("/generate", response_model=AudioResponse)
 async def generate_audio(request: AudioRequest) -> AudioResponse:
     """
     Generate audio from text using text-to-speech.
@@ -37,6 +45,8 @@ async def generate_audio(request: AudioRequest) -> AudioResponse:
             detail="Text is required for audio generation"
         )
     
+    from services.speech_service import get_speech_service
+    
     try:
         speech_service = get_speech_service()
         response = await speech_service.generate_audio(
@@ -48,41 +58,61 @@ async def generate_audio(request: AudioRequest) -> AudioResponse:
         return response
         
     except Exception as e:
-        logger.error(f"Audio generation failed: {e}")
+        logger.error("Audio generation failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Audio generation failed: {str(e)}")
 
 
-@router.get(
-    "/{audio_id}",
-    response_class=FileResponse,
-    responses={
-        404: {"model": ErrorResponse}
-    }
-)
-async def get_audio(audio_id: str):
+@router.get("/{audio_id}", response_class=StreamingResponse)
+async def get_audio(audio_id: str, request: Request):
     """
     Retrieve a generated audio file by ID.
+    
+    Answers 304 Not Modified when the client already holds this file.
     """
+    from services.speech_service import get_speech_service
+    
     speech_service = get_speech_service()
-    audio_file = speech_service.get_audio_file(audio_id)
+    audio = speech_service.get_audio_bytes(audio_id)
+    audio_file = None
+    if audio is None:
+        audio_file = await speech_service.get_audio_file(audio_id)
+        if not audio_file:
+            raise HTTPException(status_code=404, detail="Audio not found")
     
-    if not audio_file:
-        raise HTTPException(status_code=404, detail="Audio not found")
+    etag = f'"{audio_id}"'
+    cache_headers = {"ETag": etag, "Cache-Control": AUDIO_CACHE_CONTROL}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=cache_headers)
+    
+    disposition = f'inline; filename="{audio_id}.mp3"'
     
-    return FileResponse(
-        path=audio_file,
+    # Recently generated audio is served from memory
+    if audio is not None:
+        return Response(
+            content=audio,
+            media_type="audio/mpeg",
+            headers={**cache_headers, "Content-Disposition": disposition}
+        )
+    
+    stat = await aiofiles.os.stat(audio_file)
+    return StreamingResponse(
+        _iter_file(audio_file),
         media_type="audio/mpeg",
-        filename=f"{audio_id}.mp3"
+        headers={
+            **cache_headers,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Content-Disposition": disposition,
+            "Content-Length": str(stat.st_size)
+        }
     )
 
 
-@router.post(
-    "/stream",
-    responses={
-        400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
-)
+@router.post("/stream")
 async def stream_audio(request: AudioRequest):
     """
     Stream audio generation in real-time.
@@ -95,6 +125,8 @@ async def stream_audio(request: AudioRequest):
             detail="Text is required for audio streaming"
         )
     
+    from services.speech_service import get_speech_service
+    
     try:
         speech_service = get_speech_service()
         
@@ -112,22 +144,19 @@ async def stream_audio(request: AudioRequest):
         )
         
     except Exception as e:
-        logger.error(f"Audio streaming failed: {e}")
+        logger.error("Audio streaming failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Audio streaming failed: {str(e)}")
 
 
-@router.delete(
-    "/{audio_id}",
-    responses={
-        404: {"model": ErrorResponse}
-    }
-)
+@router.delete("/{audio_id}")
 async def delete_audio(audio_id: str):
     """
     Delete a generated audio file.
     """
+    from services.speech_service import get_speech_service
+    
     speech_service = get_speech_service()
-    deleted = speech_service.delete_audio(audio_id)
+    deleted = await speech_service.delete_audio(audio_id)
     
     if not deleted:
         raise HTTPException(status_code=404, detail="Audio not found")
@@ -142,17 +171,14 @@ async def list_voices(
     """
     List available TTS voices.
     """
+    from services.speech_service import SpeechService
+    
     try:
-        from services.speech_service import SpeechService
-        voices = await SpeechService.list_available_voices()
-        
-        if language:
-            voices = [v for v in voices if v["language"] == language]
-        
+        voices = await SpeechService.list_available_voices(language)
         return {"voices": voices}
         
     except Exception as e:
-        logger.error(f"Failed to list voices: {e}")
+        logger.error("Failed to list voices: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to list voices: {str(e)}")
 
 
@@ -165,6 +191,8 @@ async def cleanup_old_audio(
     
     Admin endpoint to remove audio files older than the specified hours.
     """
+    from services.speech_service import get_speech_service
+    
     try:
         speech_service = get_speech_service()
         deleted_count = await speech_service.cleanup_old_files(max_age_hours)
@@ -175,5 +203,5 @@ async def cleanup_old_audio(
         }
         
     except Exception as e:
-        logger.error(f"Cleanup failed: {e}")
+        logger.error("Cleanup failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Cleanup failed: {str(e)}")
@@ -3,18 +3,17 @@ Input Handler Router for multimodal input processing.
 Handles sketches, diagrams, and keyword inputs.
 """
 
-import base64
 import logging
 from typing import Optional
 
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from pydantic import ValidationError
 
+from config import get_settings
 from models.schemas import (
     InputType,
     StoryRequest,
-    ImageAnalysisResult,
-    ErrorResponse
+    ImageAnalysisResult
 )
 from services.ai_processor import get_ai_processor
 
@@ -22,15 +21,20 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/input", tags=["Input Handler"])
 
+# Accepted upload MIME types
+_ALLOWED_TYPES = frozenset({"image/png", "image/jpeg", "image/jpg"})
 
-@router.post(
-    "/analyze",
-    response_model=ImageAnalysisResult,
-    responses={
-        400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
+# Leading bytes of the accepted image formats -> actual MIME type
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
 )
+
+# Input types accepted for uploaded images
+_INPUT_TYPES = {e.value: e for e in (InputType.SKETCH, InputType.DIAGRAM)}
+
+
+@router.post("/analyze", response_model=ImageAnalysisResult)
 async def analyze_input(request: StoryRequest) -> ImageAnalysisResult:
     """
     Analyze multimodal input (sketch, diagram, or keywords).
@@ -62,21 +66,14 @@ async def analyze_input(request: StoryRequest) -> ImageAnalysisResult:
         return result
         
     except ValidationError as e:
-        logger.error(f"Validation error: {e}")
+        logger.error("Validation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Input analysis failed: {e}")
+        logger.error("Input analysis failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
-@router.post(
-    "/upload",
-    response_model=ImageAnalysisResult,
-    responses={
-        400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
-)
+@router.post("/upload", response_model=ImageAnalysisResult)
 async def upload_and_analyze(
     file: UploadFile = File(..., description="Image file (PNG, JPG, JPEG)"),
     input_type: str = Form(default="diagram", description="Type: sketch or diagram"),
@@ -88,46 +85,58 @@ async def upload_and_analyze(
     Supports PNG, JPG, and JPEG image formats.
     """
     # Validate file type
-    allowed_types = ["image/png", "image/jpeg", "image/jpg"]
-    if file.content_type not in allowed_types:
+    if file.content_type not in _ALLOWED_TYPES:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
+            detail="Invalid file type. Allowed: image/png, image/jpeg, image/jpg"
         )
     
     # Validate input_type
-    try:
-        input_type_enum = InputType(input_type)
-    except ValueError:
+    input_type_enum = _INPUT_TYPES.get(input_type)
+    if input_type_enum is None:
         raise HTTPException(
             status_code=400,
             detail=f"Invalid input_type. Must be 'sketch' or 'diagram'"
         )
     
-    # Read and encode file
+    # Check the file really is a PNG/JPEG before it can reach the AI
+    header = await file.read(12)
+    mime_type = next(
+        (mime for magic, mime in _IMAGE_SIGNATURES if header.startswith(magic)),
+        None
+    )
+    if mime_type is None:
+        raise HTTPException(status_code=400, detail="File is not a PNG or JPEG image")
+    
+    max_bytes = get_settings().max_upload_bytes
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail="Image file is too large")
+    
+    # Read the file; the processor encodes it only if the provider needs it
     try:
-        content = await file.read()
-        image_data = base64.b64encode(content).decode("utf-8")
+        await file.seek(0)
+        content = await file.read(max_bytes + 1)
+        if len(content) > max_bytes:
+            raise HTTPException(status_code=413, detail="Image file is too large")
         
         # Get processor and analyze
         processor = get_ai_processor()
-        result = await processor.analyze_image(image_data, input_type_enum)
+        result = await processor.analyze_image_bytes(
+            content,
+            input_type_enum,
+            mime_type=mime_type
+        )
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"File upload analysis failed: {e}")
+        logger.error("File upload analysis failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
-@router.post(
-    "/keywords",
-    response_model=ImageAnalysisResult,
-    responses={
-        400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
-)
+@router.post("/keywords", response_model=ImageAnalysisResult)
 async def analyze_keywords(
     keywords: str = Form(..., description="Keywords or topic description"),
     age_group: str = Form(default="8-10", description="Target age group")
@@ -149,5 +158,5 @@ async def analyze_keywords(
         return result
         
     except Exception as e:
-        logger.error(f"Keyword analysis failed: {e}")
+        logger.error("Keyword analysis failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
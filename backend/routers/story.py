@@ -3,10 +3,13 @@ Story Router for story generation and management.
 Handles story creation, retrieval, and quiz generation.
 """
 
+import asyncio
 import logging
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Query
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
 
 from models.schemas import (
@@ -14,29 +17,94 @@ from models.schemas import (
     StoryRequest,
     StoryResponse,
     QuizResponse,
-    ImageAnalysisResult,
-    ErrorResponse
+    AudioResponse,
+    ImageAnalysisResult
 )
 from services.ai_processor import get_ai_processor
-from services.story_engine import get_story_engine
+from services.story_engine import StoryEngine, get_story_engine
 from services.quiz_generator import get_quiz_generator
+from services.cache import get_cache_service
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/story", tags=["Story Engine"])
 
-# In-memory story cache (use Redis in production)
-_story_cache: dict[str, StoryResponse] = {}
 
+async def _analyze_input(
+    request: StoryRequest,
+    story_engine: StoryEngine
+) -> ImageAnalysisResult:
+    """Analyze the image or keywords of a story request."""
+    processor = get_ai_processor()
+    
+    if request.input_type in [InputType.SKETCH, InputType.DIAGRAM]:
+        if not request.image_data:
+            raise HTTPException(
+                status_code=400,
+                detail="Image data is required for sketch/diagram input"
+            )
+        return await processor.analyze_image(
+            request.image_data,
+            request.input_type
+        )
+    
+    if not request.keywords:
+        raise HTTPException(
+            status_code=400,
+            detail="Keywords are required for keyword input"
+        )
+    # Prime the story engine's curriculum lookups alongside analysis
+    analysis, _ = await asyncio.gather(
+        processor.process_keywords(request.keywords),
+        story_engine.prewarm(request.keywords)
+    )
+    return analysis
 
-@router.post(
-    "/generate",
-    response_model=StoryResponse,
-    responses={
-        400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
-)
+
+async def _narrate(story: StoryResponse, language: str) -> Optional[AudioResponse]:
+    """Generate narration for a story, or None if speech synthesis fails."""
+    # Imported here so the TTS backends load only when narration is asked for
+    from services.speech_service import get_speech_service
+    
+    try:
+        return await get_speech_service().generate_audio(story.content, language)
+    except Exception as e:
+        logger.warning("Story narration failed: %s", e)
+        return None
+
+
+async def _add_quiz_and_audio(
+    story: StoryResponse,
+    include_quiz: bool,
+    include_audio: bool,
+    language: str
+) -> None:
+    """
+    Attach a quiz and narration to a story.
+    
+    Both only depend on the finished story, so they run concurrently.
+    """
+    jobs = {}
+    if include_quiz:
+        jobs["quiz"] = get_quiz_generator().generate_quiz(story, num_questions=3)
+    if include_audio:
+        jobs["audio"] = _narrate(story, language)
+    
+    results = dict(zip(jobs, await asyncio.gather(*jobs.values())))
+    
+    if "quiz" in results:
+        story.quiz = results["quiz"]
+    if results.get("audio") is not None:
+        story.audio = results["audio"]
+        story.audio_available = True
+
+
+def _sse_event(event: str, data: bytes) -> bytes:
+    """Format one Server-Sent Events message."""
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+
+@router.post("/generate", response_model=StoryResponse)
 async def generate_story(request: StoryRequest) -> StoryResponse:
     """
     Generate an interactive story from multimodal input.
@@ -46,67 +114,88 @@ async def generate_story(request: StoryRequest) -> StoryResponse:
     """
     try:
         # Step 1: Analyze input
-        processor = get_ai_processor()
-        
-        if request.input_type in [InputType.SKETCH, InputType.DIAGRAM]:
-            if not request.image_data:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Image data is required for sketch/diagram input"
-                )
-            analysis = await processor.analyze_image(
-                request.image_data,
-                request.input_type
-            )
-        else:
-            if not request.keywords:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Keywords are required for keyword input"
-                )
-            analysis = await processor.process_keywords(request.keywords)
+        story_engine = get_story_engine()
+        analysis = await _analyze_input(request, story_engine)
         
         # Step 2: Generate story
-        story_engine = get_story_engine()
         story = await story_engine.generate_story(
             analysis,
             age_group=request.age_group,
             language=request.language
         )
         
-        # Step 3: Generate quiz
-        quiz_generator = get_quiz_generator()
-        quiz = await quiz_generator.generate_quiz(story, num_questions=3)
-        
-        # Update story with quiz
-        story.quiz = quiz
+        # Step 3: Generate quiz and narration from the finished story
+        await _add_quiz_and_audio(
+            story,
+            include_quiz=True,
+            include_audio=request.include_audio,
+            language=request.language
+        )
         
         # Cache the story
-        _story_cache[story.story_id] = story
+        await get_cache_service().set_story(story.story_id, story)
         
         return story
         
     except ValidationError as e:
-        logger.error(f"Validation error: {e}")
+        logger.error("Validation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Story generation failed: {e}")
+        logger.error("Story generation failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Story generation failed: {str(e)}")
 
 
-@router.post(
-    "/from-analysis",
-    response_model=StoryResponse,
-    responses={
-        400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
-)
+@router.post("/generate/stream")
+async def stream_story(request: StoryRequest) -> StreamingResponse:
+    """
+    Generate a story from multimodal input and stream it as it is written.
+    
+    Responds with Server-Sent Events: a "token" event per text chunk,
+    whose data is a JSON string, then a "story" event with the parsed
+    and cached StoryResponse. Quizzes are not included; request one
+    from the quiz endpoint with the returned story_id.
+    """
+    story_engine = get_story_engine()
+    try:
+        analysis = await _analyze_input(request, story_engine)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Story analysis failed: %s", e)
+        raise HTTPException(status_code=500, detail=f"Story generation failed: {str(e)}")
+    
+    async def events():
+        parts = []
+        try:
+            async for text in story_engine.stream_story(
+                analysis,
+                age_group=request.age_group,
+                language=request.language
+            ):
+                parts.append(text)
+                yield _sse_event("token", orjson.dumps(text))
+            
+            story = story_engine.build_story("".join(parts), analysis, request.age_group)
+            await get_cache_service().set_story(story.story_id, story)
+            yield _sse_event("story", story.model_dump_json().encode())
+        except Exception as e:
+            logger.error("Story streaming failed: %s", e)
+            yield _sse_event("error", orjson.dumps({"detail": f"Story generation failed: {str(e)}"}))
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/from-analysis", response_model=StoryResponse)
 async def generate_story_from_analysis(
     analysis: ImageAnalysisResult,
     age_group: str = Query(default="8-10", description="Target age group"),
     language: str = Query(default="en", description="Story language"),
-    include_quiz: bool = Query(default=True, description="Include quiz questions")
+    include_quiz: bool = Query(default=True, description="Include quiz questions"),
+    include_audio: bool = Query(default=False, description="Include narration audio")
 ) -> StoryResponse:
     """
     Generate a story from a pre-analyzed input.
@@ -123,47 +212,36 @@ async def generate_story_from_analysis(
             language=language
         )
         
-        # Generate quiz if requested
-        if include_quiz:
-            quiz_generator = get_quiz_generator()
-            quiz = await quiz_generator.generate_quiz(story, num_questions=3)
-            story.quiz = quiz
+        # Generate quiz and narration if requested
+        await _add_quiz_and_audio(
+            story,
+            include_quiz=include_quiz,
+            include_audio=include_audio,
+            language=language
+        )
         
         # Cache the story
-        _story_cache[story.story_id] = story
+        await get_cache_service().set_story(story.story_id, story)
         
         return story
         
     except Exception as e:
-        logger.error(f"Story generation failed: {e}")
+        logger.error("Story generation failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Story generation failed: {str(e)}")
 
 
-@router.get(
-    "/{story_id}",
-    response_model=StoryResponse,
-    responses={
-        404: {"model": ErrorResponse}
-    }
-)
+@router.get("/{story_id}", response_model=StoryResponse)
 async def get_story(story_id: str) -> StoryResponse:
     """
     Retrieve a previously generated story by ID.
     """
-    story = _story_cache.get(story_id)
+    story = await get_cache_service().get_story(story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
     return story
 
 
-@router.post(
-    "/{story_id}/quiz",
-    response_model=QuizResponse,
-    responses={
-        404: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
-    }
-)
+@router.post("/{story_id}/quiz", response_model=QuizResponse)
 async def regenerate_quiz(
     story_id: str,
     num_questions: int = Query(default=3, ge=1, le=5)
@@ -171,34 +249,39 @@ async def regenerate_quiz(
     """
     Regenerate quiz questions for an existing story.
     """
-    story = _story_cache.get(story_id)
+    story = await get_cache_service().get_story(story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
     
     try:
         quiz_generator = get_quiz_generator()
-        quiz = await quiz_generator.generate_quiz(story, num_questions=num_questions)
+        # A regenerated quiz must be fresh, so bypass the completion cache
+        quiz = await quiz_generator.generate_quiz(
+            story,
+            num_questions=num_questions,
+            use_cache=False
+        )
         
         # Update cached story
         story.quiz = quiz
-        _story_cache[story_id] = story
+        await get_cache_service().set_story(story_id, story)
         
         return quiz
         
     except Exception as e:
-        logger.error(f"Quiz regeneration failed: {e}")
+        logger.error("Quiz regeneration failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Quiz generation failed: {str(e)}")
 
 
-@router.get(
-    "/",
-    response_model=list[StoryResponse]
-)
+@router.get("/", response_model=list[StoryResponse])
 async def list_stories(
     limit: int = Query(default=10, ge=1, le=50)
-) -> list[StoryResponse]:
+) -> Response:
     """
     List recently generated stories.
     """
-    stories = list(_story_cache.values())
-    return stories[:limit]
+    # Returned pre-serialized so FastAPI does not re-validate every story
+    return Response(
+        content=await get_cache_service().list_stories_json(limit),
+        media_type="application/json"
+    )
@@ -1,17 +1,27 @@
 """Services package for AI processing and content generation."""
 
-from .ai_processor import AIProcessor, get_ai_processor
-from .story_engine import StoryEngine, get_story_engine
-from .quiz_generator import QuizGenerator, get_quiz_generator
-from .speech_service import SpeechService, get_speech_service
+from importlib import import_module
 
-__all__ = [
-    "AIProcessor",
-    "get_ai_processor",
-    "StoryEngine",
-    "get_story_engine",
-    "QuizGenerator",
-    "get_quiz_generator",
-    "SpeechService",
-    "get_speech_service",
-]
+# Exported names are resolved on first access so importing one service
+# does not initialize every AI and speech backend.
+_EXPORTS = {
+    "AIProcessor": "ai_processor",
+    "get_ai_processor": "ai_processor",
+    "StoryEngine": "story_engine",
+    "get_story_engine": "story_engine",
+    "QuizGenerator": "quiz_generator",
+    "get_quiz_generator": "quiz_generator",
+    "SpeechService": "speech_service",
+    "get_speech_service": "speech_service",
+    "CacheService": "cache",
+    "get_cache_service": "cache",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name in _EXPORTS:
+        module = import_module(f".{_EXPORTS[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
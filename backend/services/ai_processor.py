@@ -3,18 +3,79 @@ AI Processing Pipeline for multimodal input analysis.
 Supports both OpenAI GPT-4o and Google Gemini for vision/text processing.
 """
 
-import base64
+import asyncio
+import hashlib
 import logging
-from typing import Optional
-from functools import lru_cache
+import re
+from collections import OrderedDict
+from functools import cache
+from itertools import chain
+from typing import Mapping, Optional
+
+import orjson
+import pybase64
 
 from config import get_settings, Settings
 from models.schemas import ImageAnalysisResult, InputType
-from models.curriculum import get_curriculum_kb, CurriculumKnowledgeBase
-from utils.retry import with_retry, APICallError, RateLimitError
+from models.curriculum import get_curriculum_kb, CurriculumKnowledgeBase, KEYWORD_SEPARATORS
+from services.cache import get_cache_service
+from utils.http_client import get_http_client, get_llm_slots
+from utils.retry import with_retry, APICallError, RateLimitError, provider_error
 
 logger = logging.getLogger(__name__)
 
+# Number of distinct keyword sets whose analysis is kept in memory
+KEYWORD_CACHE_SIZE = 1024
+
+# Images larger than this are base64-encoded/decoded in a worker thread
+# so a big upload does not stall the event loop
+BASE64_OFFLOAD_THRESHOLD = 256 * 1024
+
+# Markdown code fences (``` or ~~~, optionally tagged json) around LLM output
+_FENCE_RE = re.compile(r"^\s*(?:```|~~~)(?:json)?\s*|\s*(?:```|~~~)\s*$", re.IGNORECASE)
+
+_IMAGE_ANALYSIS_BASE_PROMPT = """Analyze this image and provide educational insights for children.
+
+Please identify:
+1. Objects and elements visible in the image
+2. The main scene or concept being depicted
+3. Educational topics that could be taught using this image
+4. Suggested curriculum topics (science, math, language arts, social studies)
+
+Respond in JSON format:
+{
+    "detected_objects": ["list", "of", "objects"],
+    "scene_description": "Brief description of the scene",
+    "educational_concepts": ["concept1", "concept2"],
+    "suggested_topics": ["topic1", "topic2"],
+    "confidence": 0.0 to 1.0
+}"""
+
+# Vision prompts per input type, built once at import
+_IMAGE_ANALYSIS_PROMPTS = {
+    InputType.SKETCH: f"This is a child's sketch drawing.\n\n{_IMAGE_ANALYSIS_BASE_PROMPT}",
+    InputType.DIAGRAM: f"This is a textbook diagram or educational image.\n\n{_IMAGE_ANALYSIS_BASE_PROMPT}",
+}
+
+_KEYWORD_PROMPT_TEMPLATE = """Given these keywords or topic description: "{keywords}"
+
+Identify educational concepts suitable for children (ages 5-13).
+
+Respond in JSON format:
+{{
+    "detected_objects": [],
+    "scene_description": "Brief description based on keywords",
+    "educational_concepts": ["concept1", "concept2"],
+    "suggested_topics": ["Math", "Science", "Language Arts", etc.],
+    "confidence": 0.0 to 1.0
+}}"""
+
+
+
+def _error_headers(exc: Exception) -> Optional[Mapping[str, str]]:
+    """Get the HTTP response headers carried by an SDK error, if any."""
+    response = getattr(exc, "response", None)
+    return getattr(response, "headers", None)
 
 class AIProcessor:
     """
@@ -27,19 +88,38 @@ class AIProcessor:
         self.provider = settings.ai_provider
         self.curriculum_kb = get_curriculum_kb()
         
-        # Initialize the appropriate client
-        if self.provider == "openai":
-            self._init_openai()
-        elif self.provider == "groq":
-            self._init_groq()
-        else:
-            self._init_gemini()
+        # The provider client is created on first use
+        self.client = None
+        self._client_lock = asyncio.Lock()
+        # Normalized keyword set -> analysis, least recently used first
+        self._keyword_results: OrderedDict[frozenset[str], ImageAnalysisResult] = OrderedDict()
+    
+    async def warmup(self) -> None:
+        """Import the provider SDK and create its client ahead of the first request."""
+        await self._ensure_client()
+    
+    async def _ensure_client(self) -> None:
+        """Initialize the appropriate client once, on first use."""
+        if self.client is not None:
+            return
+        async with self._client_lock:
+            if self.client is not None:
+                return
+            if self.provider == "openai":
+                self._init_openai()
+            elif self.provider == "groq":
+                self._init_groq()
+            else:
+                self._init_gemini()
     
     def _init_openai(self) -> None:
         """Initialize OpenAI client."""
         try:
             from openai import AsyncOpenAI
-            self.client = AsyncOpenAI(api_key=self.settings.openai_api_key)
+            self.client = AsyncOpenAI(
+                api_key=self.settings.openai_api_key,
+                http_client=get_http_client()
+            )
             self.model = "gpt-4o"
             logger.info("Initialized OpenAI client with GPT-4o")
         except ImportError:
@@ -62,7 +142,10 @@ class AIProcessor:
         """Initialize Groq client."""
         try:
             from groq import AsyncGroq
-            self.client = AsyncGroq(api_key=self.settings.groq_api_key)
+            self.client = AsyncGroq(
+                api_key=self.settings.groq_api_key,
+                http_client=get_http_client()
+            )
             self.model = "llama-3.3-70b-versatile"
             self.vision_model = "llama-3.2-90b-vision-preview"
             logger.info("Initialized Groq client")
@@ -70,7 +153,6 @@ class AIProcessor:
             logger.error("Groq package not installed")
             raise ImportError("groq package is required for Groq provider")
     
-    @with_retry(max_attempts=3, min_wait=1.0, max_wait=10.0)
     async def analyze_image(
         self, 
         image_data: str, 
@@ -80,66 +162,125 @@ class AIProcessor:
         Analyze an image (sketch or diagram) using vision AI.
         
         Args:
-            image_data: Base64-encoded image data
+            image_data: Base64 data URI, as normalized by StoryRequest
             input_type: Type of input (sketch or diagram)
         
         Returns:
             ImageAnalysisResult with detected objects and educational concepts
         """
+        if self.provider != "gemini":
+            return await self._analyze_image(image_data, input_type)
+        
+        # Gemini takes raw bytes plus the MIME type from the URI header
+        header, _, payload = image_data.partition(",")
+        mime_type = header[5:].split(";", 1)[0] or "image/png"
+        # The request validator has already checked the base64 alphabet,
+        # so skip re-validation in the SIMD decoder (this is the only decode)
+        if len(payload) > BASE64_OFFLOAD_THRESHOLD:
+            image = await asyncio.to_thread(pybase64.b64decode, payload, validate=False)
+        else:
+            image = pybase64.b64decode(payload, validate=False)
+        
+        return await self._analyze_image(image, input_type, mime_type)
+    
+    async def analyze_image_bytes(
+        self,
+        raw: bytes,
+        input_type: InputType,
+        mime_type: str = "image/png"
+    ) -> ImageAnalysisResult:
+        """
+        Analyze raw image bytes, e.g. from a file upload.
+        
+        Gemini takes the bytes as-is; OpenAI and Groq need a data URI, so
+        the image is base64-encoded exactly once here.
+        """
+        if self.provider == "gemini":
+            image = raw
+        else:
+            if len(raw) > BASE64_OFFLOAD_THRESHOLD:
+                encoded = await asyncio.to_thread(pybase64.b64encode_as_string, raw)
+            else:
+                encoded = pybase64.b64encode_as_string(raw)
+            image = f"data:{mime_type};base64,{encoded}"
+        
+        return await self._analyze_image(image, input_type, mime_type)
+    
+    async def _analyze_image(
+        self,
+        image: str | bytes,
+        input_type: InputType,
+        mime_type: str = "image/png"
+    ) -> ImageAnalysisResult:
+        """Analyze a data URI (OpenAI/Groq) or raw bytes (Gemini), with caching."""
+        prompt = _IMAGE_ANALYSIS_PROMPTS.get(
+            input_type,
+            _IMAGE_ANALYSIS_PROMPTS[InputType.DIAGRAM]
+        )
+        
+        # Re-uploads of the same image skip the vision call entirely
+        cache = get_cache_service()
+        cache_key = self._image_cache_key(image, prompt)
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return ImageAnalysisResult.model_validate_json(cached)
+        
+        result = await self._run_image_analysis(image, prompt, mime_type)
+        await cache.set(
+            cache_key,
+            result.model_dump_json().encode(),
+            ttl=self.settings.image_cache_ttl
+        )
+        return result
+    
+    def _image_cache_key(self, image: str | bytes, prompt: str) -> str:
+        """Build the cache key for an image and prompt under this provider."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(image.encode("ascii") if isinstance(image, str) else image)
+        digest.update(prompt.encode())
+        return f"llm:img:{self.provider}:{digest.hexdigest()}"
+    
+    @with_retry(max_attempts=3, min_wait=1.0, max_wait=10.0)
+    async def _run_image_analysis(
+        self,
+        image: str | bytes,
+        prompt: str,
+        mime_type: str
+    ) -> ImageAnalysisResult:
+        """Run vision analysis and map the result to curriculum concepts."""
         try:
-            prompt = self._build_image_analysis_prompt(input_type)
+            await self._ensure_client()
             
-            if self.provider == "openai":
-                result = await self._analyze_with_openai(image_data, prompt)
-            elif self.provider == "groq":
-                result = await self._analyze_with_groq(image_data, prompt)
-            else:
-                result = await self._analyze_with_gemini(image_data, prompt)
+            async with get_llm_slots():
+                if self.provider == "openai":
+                    result = await self._analyze_with_openai(image, prompt)
+                elif self.provider == "groq":
+                    result = await self._analyze_with_groq(image, prompt)
+                else:
+                    result = await self._analyze_with_gemini(image, prompt, mime_type)
             
             # Map to curriculum concepts
             enriched_result = self._enrich_with_curriculum(result)
             
             return enriched_result
             
+        except APICallError as e:
+            # Keep rate-limit details such as retry_after for the backoff
+            logger.error("Image analysis failed: %s", e)
+            raise
         except Exception as e:
-            logger.error(f"Image analysis failed: {e}")
-            raise APICallError(f"Image analysis failed: {str(e)}", provider=self.provider)
-    
-    def _build_image_analysis_prompt(self, input_type: InputType) -> str:
-        """Build the prompt for image analysis."""
-        base_prompt = """Analyze this image and provide educational insights for children.
-
-Please identify:
-1. Objects and elements visible in the image
-2. The main scene or concept being depicted
-3. Educational topics that could be taught using this image
-4. Suggested curriculum topics (science, math, language arts, social studies)
-
-Respond in JSON format:
-{
-    "detected_objects": ["list", "of", "objects"],
-    "scene_description": "Brief description of the scene",
-    "educational_concepts": ["concept1", "concept2"],
-    "suggested_topics": ["topic1", "topic2"],
-    "confidence": 0.0 to 1.0
-}"""
-        
-        if input_type == InputType.SKETCH:
-            return f"This is a child's sketch drawing.\n\n{base_prompt}"
-        else:
-            return f"This is a textbook diagram or educational image.\n\n{base_prompt}"
+            logger.error("Image analysis failed: %s", e)
+            raise provider_error(
+                e, f"Image analysis failed: {str(e)}", self.provider
+            ) from e
     
     async def _analyze_with_openai(
         self, 
-        image_data: str, 
+        image_url: str, 
         prompt: str
     ) -> ImageAnalysisResult:
         """Analyze image using OpenAI GPT-4o Vision."""
         try:
-            # Ensure proper base64 format
-            if not image_data.startswith("data:"):
-                image_data = f"data:image/png;base64,{image_data}"
-            
             response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
@@ -149,7 +290,7 @@ Respond in JSON format:
                             {"type": "text", "text": prompt},
                             {
                                 "type": "image_url",
-                                "image_url": {"url": image_data}
+                                "image_url": {"url": image_url}
                             }
                         ]
                     }
@@ -163,27 +304,25 @@ Respond in JSON format:
             
         except Exception as e:
             if "rate_limit" in str(e).lower():
-                raise RateLimitError(f"OpenAI rate limit exceeded: {e}")
+                raise RateLimitError(
+                    f"OpenAI rate limit exceeded: {e}",
+                    status_code=429,
+                    provider="openai",
+                    headers=_error_headers(e)
+                )
             raise
     
     async def _analyze_with_gemini(
         self, 
-        image_data: str, 
-        prompt: str
+        image_bytes: bytes, 
+        prompt: str,
+        mime_type: str = "image/png"
     ) -> ImageAnalysisResult:
         """Analyze image using Google Gemini Vision."""
-        import google.generativeai as genai
-        
         try:
-            # Decode base64 image
-            if image_data.startswith("data:"):
-                image_data = image_data.split(",", 1)[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            
             # Create image part
             image_part = {
-                "mime_type": "image/png",
+                "mime_type": mime_type,
                 "data": image_bytes
             }
             
@@ -195,20 +334,20 @@ Respond in JSON format:
             
         except Exception as e:
             if "quota" in str(e).lower():
-                raise RateLimitError(f"Gemini rate limit exceeded: {e}")
+                raise RateLimitError(
+                    f"Gemini rate limit exceeded: {e}",
+                    status_code=429,
+                    provider="gemini"
+                )
             raise
     
     async def _analyze_with_groq(
         self, 
-        image_data: str, 
+        image_url: str, 
         prompt: str
     ) -> ImageAnalysisResult:
         """Analyze image using Groq Vision (Llama 3.2 Vision)."""
         try:
-            # Ensure proper base64 format
-            if not image_data.startswith("data:"):
-                image_data = f"data:image/png;base64,{image_data}"
-            
             response = await self.client.chat.completions.create(
                 model=self.vision_model,
                 messages=[
@@ -218,7 +357,7 @@ Respond in JSON format:
                             {"type": "text", "text": prompt},
                             {
                                 "type": "image_url",
-                                "image_url": {"url": image_data}
+                                "image_url": {"url": image_url}
                             }
                         ]
                     }
@@ -231,32 +370,36 @@ Respond in JSON format:
             
         except Exception as e:
             if "rate_limit" in str(e).lower():
-                raise RateLimitError(f"Groq rate limit exceeded: {e}")
+                raise RateLimitError(
+                    f"Groq rate limit exceeded: {e}",
+                    status_code=429,
+                    provider="groq",
+                    headers=_error_headers(e)
+                )
             raise
     
     def _parse_analysis_result(self, result_text: str) -> ImageAnalysisResult:
         """Parse the AI response into ImageAnalysisResult."""
-        import json
-        
         try:
             # Clean up the response if needed
-            result_text = result_text.strip()
-            if result_text.startswith("```json"):
-                result_text = result_text[7:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
+            result_text = _FENCE_RE.sub("", result_text.strip())
             
-            data = json.loads(result_text)
+            data = orjson.loads(result_text)
             
+            # Clamp the confidence into the model's 0-1 range; validation
+            # sends replies with malformed fields to the fallback below
+            confidence = min(max(float(data.get("confidence", 0.8)), 0.0), 1.0)
             return ImageAnalysisResult(
                 detected_objects=data.get("detected_objects", []),
                 scene_description=data.get("scene_description", ""),
                 educational_concepts=data.get("educational_concepts", []),
                 suggested_topics=data.get("suggested_topics", []),
-                confidence=float(data.get("confidence", 0.8))
+                confidence=confidence
             )
-        except json.JSONDecodeError as e:
-            logger.warning(f"Failed to parse AI response as JSON: {e}")
+        except (ValueError, TypeError, AttributeError) as e:
+            # ValueError covers orjson's decode errors and pydantic's
+            # ValidationError; AttributeError a reply that is not an object
+            logger.warning("Failed to parse AI response: %s", e)
             # Return a basic result
             return ImageAnalysisResult(
                 detected_objects=["drawing"],
@@ -281,16 +424,32 @@ Respond in JSON format:
         # Find matching curriculum topics
         matching_topics = self.curriculum_kb.find_matching_topics(keywords, max_results=3)
         
+        if len(matching_topics) < 3 and result.scene_description:
+            # Fill the remaining slots from topics named in the free-text
+            # scene description
+            found = {topic.id for topic in matching_topics}
+            matching_topics += [
+                topic
+                for topic in self.curriculum_kb.find_matching_topics_from_text(
+                    result.scene_description, max_results=3
+                )
+                if topic.id not in found
+            ][:3 - len(matching_topics)]
+        
         if matching_topics:
-            # Add curriculum-aligned topics
-            curriculum_topics = [topic.name for topic in matching_topics]
-            result.suggested_topics = list(set(result.suggested_topics + curriculum_topics))
+            # Add curriculum-aligned topics, deduplicated in order
+            result.suggested_topics = list(dict.fromkeys(chain(
+                result.suggested_topics,
+                (topic.name for topic in matching_topics)
+            )))
             
             # Add learning objectives as educational concepts
-            for topic in matching_topics:
-                result.educational_concepts.extend(topic.learning_objectives[:2])
-            
-            result.educational_concepts = list(set(result.educational_concepts))
+            result.educational_concepts = list(dict.fromkeys(chain(
+                result.educational_concepts,
+                chain.from_iterable(
+                    topic.learning_objectives[:2] for topic in matching_topics
+                )
+            )))
         
         return result
     
@@ -308,19 +467,50 @@ Respond in JSON format:
         Returns:
             ImageAnalysisResult with identified concepts
         """
-        # Split keywords
-        keyword_list = [kw.strip() for kw in keywords.replace(",", " ").split()]
+        # Split and normalize keywords; order and repeats do not change the result
+        keyword_set = frozenset(filter(None, KEYWORD_SEPARATORS.split(keywords.lower())))
+        
+        cached = self._keyword_results.get(keyword_set)
+        if cached is not None:
+            self._keyword_results.move_to_end(keyword_set)
+            return cached.model_copy(deep=True)
+        
+        try:
+            result = await self._analyze_keywords(keyword_set, keywords)
+        except Exception as e:
+            logger.error("Keyword interpretation failed: %s", e)
+            # Fallback response, not cached so the next request retries the AI
+            return ImageAnalysisResult(
+                detected_objects=[],
+                scene_description=f"Topic: {keywords}",
+                educational_concepts=[keywords],
+                suggested_topics=["General Learning"],
+                confidence=0.5
+            )
         
+        self._keyword_results[keyword_set] = result
+        if len(self._keyword_results) > KEYWORD_CACHE_SIZE:
+            self._keyword_results.popitem(last=False)
+        return result.model_copy(deep=True)
+    
+    async def _analyze_keywords(
+        self,
+        keyword_set: frozenset[str],
+        keywords: str
+    ) -> ImageAnalysisResult:
+        """Map keywords to curriculum topics, falling back to the AI."""
         # Find matching curriculum topics
         matching_topics = self.curriculum_kb.find_matching_topics(
-            keyword_list, 
+            list(keyword_set), 
             max_results=3
         )
         
         if matching_topics:
             return ImageAnalysisResult(
                 detected_objects=[],
-                scene_description=f"Keywords: {keywords}",
+                # Built from the normalized set, which is also the cache
+                # key, so every spelling of these keywords gets the same text
+                scene_description=f"Keywords: {', '.join(sorted(keyword_set))}",
                 educational_concepts=[
                     obj for topic in matching_topics 
                     for obj in topic.learning_objectives[:2]
@@ -337,20 +527,10 @@ Respond in JSON format:
         keywords: str
     ) -> ImageAnalysisResult:
         """Use AI to interpret keywords and find educational concepts."""
-        prompt = f"""Given these keywords or topic description: "{keywords}"
-
-Identify educational concepts suitable for children (ages 5-13).
-
-Respond in JSON format:
-{{
-    "detected_objects": [],
-    "scene_description": "Brief description based on keywords",
-    "educational_concepts": ["concept1", "concept2"],
-    "suggested_topics": ["Math", "Science", "Language Arts", etc.],
-    "confidence": 0.0 to 1.0
-}}"""
+        prompt = _KEYWORD_PROMPT_TEMPLATE.format(keywords=keywords)
         
-        try:
+        await self._ensure_client()
+        async with get_llm_slots():
             if self.provider == "openai":
                 response = await self.client.chat.completions.create(
                     model=self.model,
@@ -371,29 +551,11 @@ Respond in JSON format:
                     prompt
                 )
                 result_text = response.text
-            
-            return self._parse_analysis_result(result_text)
-            
-        except Exception as e:
-            logger.error(f"Keyword interpretation failed: {e}")
-            # Fallback response
-            return ImageAnalysisResult(
-                detected_objects=[],
-                scene_description=f"Topic: {keywords}",
-                educational_concepts=[keywords],
-                suggested_topics=["General Learning"],
-                confidence=0.5
-            )
-
-
-# Singleton instance
-_processor_instance: Optional[AIProcessor] = None
+        
+        return self._parse_analysis_result(result_text)
 
 
+@cache
 def get_ai_processor() -> AIProcessor:
     """Get the singleton AI processor instance."""
-    global _processor_instance
-    if _processor_instance is None:
-        settings = get_settings()
-        _processor_instance = AIProcessor(settings)
-    return _processor_instance
+    return AIProcessor(get_settings())
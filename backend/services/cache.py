@@ -0,0 +1,191 @@
+"""
+Cache Service for sharing stories and AI results across workers.
+Uses Redis when configured, with a bounded in-process fallback.
+"""
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from functools import cache
+from itertools import islice
+from typing import Optional
+
+from pydantic import TypeAdapter
+
+from config import get_settings, Settings
+from models.schemas import StoryResponse
+
+logger = logging.getLogger(__name__)
+
+STORY_KEY_PREFIX = "story:"
+RECENT_STORIES_KEY = "stories:recent"
+
+# Entry limit for generic values when running without Redis
+MEMORY_CACHE_MAX_ENTRIES = 1024
+
+_STORY_LIST_ADAPTER = TypeAdapter(list[StoryResponse])
+
+
+class CacheService:
+    """
+    Story and result cache backed by Redis.
+
+    Stories are stored as JSON under their own key with a TTL, and a
+    sorted set keyed by creation time tracks the most recent ones. Other
+    callers can cache opaque bytes with get/set. When no Redis URL is
+    configured the cache falls back to bounded in-process stores, which
+    are not shared between workers.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.ttl = settings.story_cache_ttl
+        self.max_stories = settings.story_cache_max
+        self._redis = None
+        # story_id -> (expires_at, story), oldest first
+        self._stories: OrderedDict[str, tuple[float, StoryResponse]] = OrderedDict()
+        # key -> (expires_at, value), oldest first
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+        if settings.redis_url:
+            import redis.asyncio as redis
+
+            self._redis = redis.from_url(settings.redis_url, decode_responses=False)
+            logger.info("Cache using Redis")
+        else:
+            logger.info("Cache using in-process memory (REDIS_URL not set)")
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Get a cached value, or None if missing or expired."""
+        if self._redis is None:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+        try:
+            return await self._redis.get(key)
+        except Exception as e:
+            logger.warning("Cache read failed: %s", e)
+            return None
+
+    async def set(self, key: str, value: bytes, ttl: int) -> None:
+        """Store a value for ttl seconds."""
+        if self._redis is None:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > MEMORY_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+            return
+
+        try:
+            await self._redis.set(key, value, ex=ttl)
+        except Exception as e:
+            logger.warning("Cache write failed: %s", e)
+
+    async def get_story(self, story_id: str) -> Optional[StoryResponse]:
+        """Get a cached story by ID, or None if missing or expired."""
+        if self._redis is None:
+            entry = self._stories.get(story_id)
+            if entry is None:
+                return None
+            expires_at, story = entry
+            if expires_at < time.monotonic():
+                del self._stories[story_id]
+                return None
+            return story
+
+        try:
+            data = await self._redis.get(STORY_KEY_PREFIX + story_id)
+        except Exception as e:
+            logger.warning("Story cache read failed: %s", e)
+            return None
+        return StoryResponse.model_validate_json(data) if data else None
+
+    async def set_story(
+        self,
+        story_id: str,
+        story: StoryResponse,
+        ttl: Optional[int] = None
+    ) -> None:
+        """Store a story and mark it as the most recent."""
+        ttl = ttl or self.ttl
+
+        if self._redis is None:
+            self._stories[story_id] = (time.monotonic() + ttl, story)
+            self._stories.move_to_end(story_id)
+            if len(self._stories) > self.max_stories:
+                self._stories.popitem(last=False)
+            return
+
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.set(STORY_KEY_PREFIX + story_id, story.model_dump_json(), ex=ttl)
+                pipe.zadd(RECENT_STORIES_KEY, {story_id: time.time()})
+                # Keep only the newest max_stories entries in the index
+                pipe.zremrangebyrank(RECENT_STORIES_KEY, 0, -self.max_stories - 1)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Story cache write failed: %s", e)
+
+    async def list_stories(self, limit: int = 10) -> list[StoryResponse]:
+        """List the most recently cached stories, newest first."""
+        if self._redis is None:
+            now = time.monotonic()
+            live = (
+                story for expires_at, story in reversed(self._stories.values())
+                if expires_at >= now
+            )
+            return list(islice(live, limit))
+
+        # Stories whose TTL has lapsed are skipped
+        return [
+            StoryResponse.model_validate_json(data)
+            for data in await self._recent_story_payloads(limit)
+        ]
+
+    async def list_stories_json(self, limit: int = 10) -> bytes:
+        """List the most recent stories as a serialized JSON array."""
+        if self._redis is None:
+            return _STORY_LIST_ADAPTER.dump_json(await self.list_stories(limit))
+
+        # Stories are stored as JSON already, so splice them without parsing
+        return b"[" + b",".join(await self._recent_story_payloads(limit)) + b"]"
+
+    async def _recent_story_payloads(self, limit: int) -> list[bytes]:
+        """Fetch the stored JSON of the newest live stories from Redis."""
+        try:
+            story_ids = await self._redis.zrevrange(RECENT_STORIES_KEY, 0, limit - 1)
+            if not story_ids:
+                return []
+            values = await self._redis.mget(
+                [STORY_KEY_PREFIX + story_id.decode() for story_id in story_ids]
+            )
+        except Exception as e:
+            logger.warning("Story cache read failed: %s", e)
+            return []
+
+        # Stories whose TTL has lapsed come back as None
+        return [data for data in values if data]
+
+    async def close(self) -> None:
+        """Close the Redis connection pool, if any."""
+        if self._redis is not None:
+            await self._redis.aclose()
+
+
+def llm_cache_key(provider: str, model: str, task: str, prompt: str) -> str:
+    """Build the cache key for an LLM completion of a prompt."""
+    digest = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    return f"llm:{task}:{provider}:{model}:{digest}"
+
+
+@cache
+def get_cache_service() -> CacheService:
+    """Get the singleton cache service instance."""
+    return CacheService(get_settings())
@@ -3,17 +3,119 @@ Quiz Generator Module for creating educational assessments.
 Automatically generates MCQs based on story content.
 """
 
+import asyncio
 import json
 import logging
 from typing import Optional
-from functools import lru_cache
+from functools import cache, lru_cache
+
+import msgspec
 
 from config import get_settings, Settings
 from models.schemas import QuizQuestion, QuizResponse, StoryResponse
-from utils.retry import with_retry, APICallError
+from services.cache import get_cache_service, llm_cache_key
+from utils.http_client import get_http_client, get_llm_slots
+from utils.retry import with_retry, APICallError, provider_error
 
 logger = logging.getLogger(__name__)
 
+# System message sent with every OpenAI/Groq completion; the SDKs only
+# read it, so one dict is shared instead of built per call
+_QUIZ_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are an educational assessment expert who creates engaging, age-appropriate quiz questions for children."
+}
+
+# Finds where the first JSON object in a reply ends, when text after it
+# contains braces of its own
+_JSON_DECODER = json.JSONDecoder()
+
+
+class _QuizQuestionData(msgspec.Struct):
+    """A question as returned by the model, before normalization."""
+    
+    question: str
+    options: list[str]
+    correct_answer: int
+    explanation: Optional[str] = ""
+
+
+class _QuizData(msgspec.Struct):
+    """Top level of a quiz response; questions are decoded one at a time."""
+    
+    questions: list[msgspec.Raw] = []
+
+
+def _decode_quiz_data(response: str) -> _QuizData:
+    """
+    Decode the quiz object out of a model reply.
+    
+    The reply is decoded from its first "{" to its last "}", dropping code
+    fences or chatter around the object. If that fails, the slice is cut
+    at the end of the first complete object instead, so a trailing note
+    with a brace in it does not sink the whole quiz.
+    """
+    start = response.find("{")
+    if start < 0:
+        return msgspec.json.decode(response, type=_QuizData)
+    
+    try:
+        return msgspec.json.decode(
+            response[start:response.rfind("}") + 1],
+            type=_QuizData
+        )
+    except msgspec.DecodeError as e:
+        try:
+            end = _JSON_DECODER.raw_decode(response, start)[1]
+        except ValueError:
+            raise e from None
+        return msgspec.json.decode(response[start:end], type=_QuizData)
+
+
+# Returned when a quiz response cannot be parsed; QuizQuestion is frozen,
+# so the one instance is shared
+_FALLBACK_QUIZ_QUESTION = QuizQuestion(
+    question="What did you learn from this story?",
+    options=[
+        "Something new and interesting",
+        "I'm not sure",
+        "Nothing new",
+        "I need to read it again"
+    ],
+    correct_answer=0,
+    explanation="Every story teaches us something new!"
+)
+
+_DIFFICULTY_GUIDELINES = {
+    "easy": "Use simple vocabulary, clear questions, and obvious correct answers.",
+    "medium": "Use grade-appropriate vocabulary with some reasoning required.",
+    "hard": "Include inference questions and require deeper understanding."
+}
+
+# Fixed tail of the quiz prompt
+_QUIZ_PROMPT_FORMAT = """- Each question must have exactly 4 options
+- Only one correct answer per question
+- Include an explanation for each correct answer
+- Questions should test comprehension and learning
+
+**Output Format (JSON):**
+{
+    "questions": [
+        {
+            "question": "The question text?",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "correct_answer": 0,
+            "explanation": "Why this answer is correct"
+        }
+    ]
+}
+
+Important: 
+- correct_answer is the index (0-3) of the correct option
+- Make questions engaging and educational
+- Ensure all options are plausible but only one is correct
+"""
+
 
 class QuizGenerator:
     """
@@ -37,11 +139,17 @@ class QuizGenerator:
         """Initialize the AI client."""
         if self.provider == "openai":
             from openai import AsyncOpenAI
-            self.client = AsyncOpenAI(api_key=self.settings.openai_api_key)
+            self.client = AsyncOpenAI(
+                api_key=self.settings.openai_api_key,
+                http_client=get_http_client()
+            )
             self.model = "gpt-4o"
         elif self.provider == "groq":
             from groq import AsyncGroq
-            self.client = AsyncGroq(api_key=self.settings.groq_api_key)
+            self.client = AsyncGroq(
+                api_key=self.settings.groq_api_key,
+                http_client=get_http_client()
+            )
             self.model = "llama-3.3-70b-versatile"
         else:
             import google.generativeai as genai
@@ -53,7 +161,8 @@ class QuizGenerator:
     async def generate_quiz(
         self,
         story: StoryResponse,
-        num_questions: int = 3
+        num_questions: int = 3,
+        use_cache: bool = True
     ) -> QuizResponse:
         """
         Generate quiz questions based on story content.
@@ -61,6 +170,7 @@ class QuizGenerator:
         Args:
             story: The generated story
             num_questions: Number of questions to generate (1-5)
+            use_cache: Reuse a cached completion for an identical prompt
         
         Returns:
             QuizResponse with MCQ questions
@@ -71,19 +181,37 @@ class QuizGenerator:
         prompt = self._build_quiz_prompt(story, num_questions, difficulty)
         
         try:
-            if self.provider == "openai":
-                quiz_data = await self._generate_with_openai(prompt)
-            elif self.provider == "groq":
-                quiz_data = await self._generate_with_groq(prompt)
+            cache = get_cache_service()
+            cache_key = llm_cache_key(self.provider, self.model, "quiz", prompt)
+            cached = await cache.get(cache_key) if use_cache else None
+            
+            if cached is not None:
+                quiz_data = cached.decode()
             else:
-                quiz_data = await self._generate_with_gemini(prompt)
+                async with get_llm_slots():
+                    if self.provider == "openai":
+                        quiz_data = await self._generate_with_openai(prompt)
+                    elif self.provider == "groq":
+                        quiz_data = await self._generate_with_groq(prompt)
+                    else:
+                        quiz_data = await self._generate_with_gemini(prompt)
             
             questions = self._parse_quiz_response(quiz_data)
             
+            # Only keep completions that produced a full quiz
+            if cached is None and len(questions) >= num_questions:
+                await cache.set(
+                    cache_key,
+                    quiz_data.encode(),
+                    ttl=self.settings.llm_cache_ttl
+                )
+            
             # Ensure we have the right number of questions
             if len(questions) < num_questions:
                 logger.warning(
-                    f"Generated {len(questions)} questions instead of {num_questions}"
+                    "Generated %d questions instead of %d",
+                    len(questions),
+                    num_questions
                 )
             
             return QuizResponse(
@@ -92,9 +220,38 @@ class QuizGenerator:
                 difficulty=difficulty
             )
             
+        except APICallError as e:
+            logger.error("Quiz generation failed: %s", e)
+            raise
         except Exception as e:
-            logger.error(f"Quiz generation failed: {e}")
-            raise APICallError(f"Quiz generation failed: {str(e)}")
+            logger.error("Quiz generation failed: %s", e)
+            raise provider_error(
+                e, f"Quiz generation failed: {str(e)}", self.provider
+            ) from e
+    
+    async def generate_quizzes(
+        self,
+        stories: list[StoryResponse],
+        num_questions: int = 3,
+        max_concurrency: Optional[int] = None
+    ) -> list[QuizResponse | BaseException]:
+        """
+        Generate quizzes for several stories concurrently.
+        
+        At most max_concurrency calls (default: the max_concurrent_llm
+        setting) are in flight at once. Results keep the order of stories;
+        a failed story yields its exception instead of a quiz.
+        """
+        slots = asyncio.Semaphore(max_concurrency or self.settings.max_concurrent_llm)
+        
+        async def generate_one(story: StoryResponse) -> QuizResponse:
+            async with slots:
+                return await self.generate_quiz(story, num_questions)
+        
+        return await asyncio.gather(
+            *(generate_one(story) for story in stories),
+            return_exceptions=True
+        )
     
     def _build_quiz_prompt(
         self,
@@ -103,14 +260,9 @@ class QuizGenerator:
         difficulty: str
     ) -> str:
         """Build the prompt for quiz generation."""
+        header, requirements = self._quiz_prompt_static(num_questions, difficulty)
         
-        difficulty_guidelines = {
-            "easy": "Use simple vocabulary, clear questions, and obvious correct answers.",
-            "medium": "Use grade-appropriate vocabulary with some reasoning required.",
-            "hard": "Include inference questions and require deeper understanding."
-        }
-        
-        return f"""Create {num_questions} multiple-choice questions based on this story.
+        return f"""{header}
 
 **Story Title:** {story.title}
 
@@ -119,41 +271,25 @@ class QuizGenerator:
 
 **Concepts Covered:** {', '.join(story.concepts_covered)}
 
-**Quiz Requirements:**
+{requirements}"""
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _quiz_prompt_static(num_questions: int, difficulty: str) -> tuple[str, str]:
+        """Build the parts of the quiz prompt that do not depend on the story."""
+        header = f"Create {num_questions} multiple-choice questions based on this story."
+        requirements = f"""**Quiz Requirements:**
 - Difficulty Level: {difficulty}
-- {difficulty_guidelines.get(difficulty, '')}
-- Each question must have exactly 4 options
-- Only one correct answer per question
-- Include an explanation for each correct answer
-- Questions should test comprehension and learning
-
-**Output Format (JSON):**
-{{
-    "questions": [
-        {{
-            "question": "The question text?",
-            "options": ["Option A", "Option B", "Option C", "Option D"],
-            "correct_answer": 0,
-            "explanation": "Why this answer is correct"
-        }}
-    ]
-}}
-
-Important: 
-- correct_answer is the index (0-3) of the correct option
-- Make questions engaging and educational
-- Ensure all options are plausible but only one is correct
-"""
+- {_DIFFICULTY_GUIDELINES.get(difficulty, '')}
+{_QUIZ_PROMPT_FORMAT}"""
+        return header, requirements
     
     async def _generate_with_openai(self, prompt: str) -> str:
         """Generate quiz using OpenAI."""
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are an educational assessment expert who creates engaging, age-appropriate quiz questions for children."
-                },
+                _QUIZ_SYSTEM_MESSAGE,
                 {"role": "user", "content": prompt}
             ],
             max_tokens=1500,
@@ -176,10 +312,7 @@ Important:
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are an educational assessment expert who creates engaging, age-appropriate quiz questions for children."
-                },
+                _QUIZ_SYSTEM_MESSAGE,
                 {"role": "user", "content": prompt}
             ],
             max_tokens=1500,
@@ -192,52 +325,42 @@ Important:
         questions = []
         
         try:
-            # Clean up response
-            response = response.strip()
-            if response.startswith("```json"):
-                response = response[7:]
-            if response.endswith("```"):
-                response = response[:-3]
-            
-            data = json.loads(response)
+            data = _decode_quiz_data(response)
             
-            for q_data in data.get("questions", []):
-                # Validate question structure
-                if not all(key in q_data for key in ["question", "options", "correct_answer"]):
+            for raw_question in data.questions:
+                # Validate question structure; malformed questions are skipped
+                try:
+                    q_data = msgspec.json.decode(
+                        raw_question,
+                        type=_QuizQuestionData,
+                        strict=False
+                    )
+                except msgspec.ValidationError:
                     continue
                 
-                options = q_data["options"]
+                options = q_data.options
                 if len(options) != 4:
                     # Pad or trim options
                     while len(options) < 4:
                         options.append("Not applicable")
                     options = options[:4]
                 
-                correct_idx = int(q_data["correct_answer"])
+                correct_idx = q_data.correct_answer
                 if correct_idx < 0 or correct_idx > 3:
                     correct_idx = 0
                 
-                questions.append(QuizQuestion(
-                    question=q_data["question"],
+                # Fields are already typed and clamped to the model's bounds
+                questions.append(QuizQuestion.model_construct(
+                    question=q_data.question,
                     options=options,
                     correct_answer=correct_idx,
-                    explanation=q_data.get("explanation", "")
+                    explanation=q_data.explanation or ""
                 ))
                 
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse quiz JSON: {e}")
+        except msgspec.DecodeError as e:
+            logger.error("Failed to parse quiz JSON: %s", e)
             # Return fallback question
-            questions.append(QuizQuestion(
-                question="What did you learn from this story?",
-                options=[
-                    "Something new and interesting",
-                    "I'm not sure",
-                    "Nothing new",
-                    "I need to read it again"
-                ],
-                correct_answer=0,
-                explanation="Every story teaches us something new!"
-            ))
+            questions.append(_FALLBACK_QUIZ_QUESTION)
         
         return questions
     
@@ -245,6 +368,20 @@ Important:
         """
         Validate that the quiz questions are appropriate and correct.
         """
+        return self._is_valid_quiz(quiz)
+    
+    async def validate_quizzes(self, quizzes: list[QuizResponse]) -> list[bool]:
+        """
+        Validate a batch of quizzes, such as for content review.
+        
+        Returns:
+            One validation result per quiz, in input order
+        """
+        return [self._is_valid_quiz(quiz) for quiz in quizzes]
+    
+    @staticmethod
+    def _is_valid_quiz(quiz: QuizResponse) -> bool:
+        """Check the structure of every question in a quiz."""
         for question in quiz.questions:
             # Check that correct_answer index is valid
             if question.correct_answer < 0 or question.correct_answer >= len(question.options):
@@ -261,14 +398,7 @@ Important:
         return True
 
 
-# Singleton instance
-_generator_instance: Optional[QuizGenerator] = None
-
-
+@cache
 def get_quiz_generator() -> QuizGenerator:
     """Get the singleton quiz generator instance."""
-    global _generator_instance
-    if _generator_instance is None:
-        settings = get_settings()
-        _generator_instance = QuizGenerator(settings)
-    return _generator_instance
+    return QuizGenerator(get_settings())
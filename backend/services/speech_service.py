@@ -4,14 +4,22 @@ Uses Edge-TTS for high-quality, multilingual speech synthesis.
 """
 
 import asyncio
+import hashlib
 import uuid
 import os
+import re
+import time
 import logging
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional
-from functools import lru_cache
+from functools import cache, lru_cache
 
+import aiofiles.os
 import edge_tts
+import orjson
+from mutagen import MutagenError
+from mutagen.mp3 import MP3
 
 from config import get_settings, Settings
 from models.schemas import AudioResponse
@@ -19,6 +27,30 @@ from utils.retry import with_retry, APICallError
 
 logger = logging.getLogger(__name__)
 
+# Texts longer than this are split at sentence boundaries into segments
+# of about this many characters, which are synthesized in parallel
+TTS_SEGMENT_CHARS = 600
+
+# Upper bound on concurrent Edge-TTS requests for one text
+TTS_MAX_PARALLEL_SEGMENTS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Total size of recently generated audio kept in memory, and the largest
+# single file kept; every file is also written to disk
+AUDIO_MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+AUDIO_MEMORY_MAX_ITEM_BYTES = 1024 * 1024
+
+# Seconds before the Edge-TTS voice list is fetched again
+VOICE_LIST_TTL = 24 * 3600
+
+# (fetched_at, voices grouped by language), shared by all instances
+_voices_cache: Optional[tuple[float, dict[Optional[str], list[dict]]]] = None
+_voices_lock = asyncio.Lock()
+
+# aiofiles has no utime, so run it on the same thread pool
+_utime = aiofiles.os.wrap(os.utime)
+
 
 class SpeechService:
     """
@@ -61,6 +93,10 @@ class SpeechService:
         # Create audio output directory
         self.audio_dir = Path(__file__).parent.parent / "audio_output"
         self.audio_dir.mkdir(exist_ok=True)
+        
+        # audio_id -> MP3 data of recently generated audio, oldest first
+        self._audio_bytes: OrderedDict[str, bytes] = OrderedDict()
+        self._audio_bytes_total = 0
     
     async def generate_audio(
         self,
@@ -83,9 +119,6 @@ class SpeechService:
         Returns:
             AudioResponse with audio file information
         """
-        audio_id = str(uuid.uuid4())
-        output_file = self.audio_dir / f"{audio_id}.mp3"
-        
         # Determine voice to use
         if voice:
             selected_voice = voice
@@ -97,34 +130,122 @@ class SpeechService:
         # Determine speech rate
         selected_rate = rate or self.default_rate
         
+        # Identical narration maps to the same file, so it is synthesized once
+        audio_id = self._audio_key(text, selected_voice, selected_rate)
+        output_file = self.audio_dir / f"{audio_id}.mp3"
+        
         try:
-            # Create TTS communicate object
-            communicate = edge_tts.Communicate(
-                text,
+            # Refresh the mtime so cleanup keeps audio that is still in use
+            await _utime(output_file)
+            return await self._audio_response(audio_id, output_file)
+        except FileNotFoundError:
+            pass
+        
+        # Write under a temporary name so concurrent requests for the same
+        # narration never serve a partially written file
+        partial_file = output_file.with_suffix(f".{uuid.uuid4().hex}.part")
+        
+        try:
+            # Long texts are synthesized a few sentences at a time in
+            # parallel; MP3 is a plain frame stream, so the segments
+            # concatenate into one playable file
+            audio = await self._synthesize_segments(
+                _split_segments(text),
                 selected_voice,
-                rate=selected_rate,
-                volume=self.default_volume
+                selected_rate
             )
             
-            # Generate audio file
-            await communicate.save(str(output_file))
-            
-            # Get file info
-            file_size = output_file.stat().st_size
-            # Estimate duration (rough estimate: ~16KB per second for MP3)
-            estimated_duration = file_size / 16000
-            
-            return AudioResponse(
-                audio_id=audio_id,
-                audio_url=f"/api/audio/{audio_id}",
-                duration_seconds=round(estimated_duration, 2),
-                format="mp3"
+            # Persist the audio, and keep small files in memory so serving
+            # them right after generation skips reading them back
+            await asyncio.get_event_loop().run_in_executor(
+                None, partial_file.write_bytes, audio
             )
+            await aiofiles.os.replace(partial_file, output_file)
+            self._remember_audio(audio_id, audio)
+            
+            return await self._audio_response(audio_id, output_file)
             
         except Exception as e:
-            logger.warning(f"Edge-TTS failed, trying gTTS fallback: {e}")
-            # Try gTTS fallback
-            return await self._generate_with_gtts(text, language, audio_id, output_file)
+            logger.warning("Edge-TTS failed, trying gTTS fallback: %s", e)
+            await _remove_if_exists(partial_file)
+            # Try gTTS fallback. Its audio gets its own ID so the next
+            # request for this narration tries Edge-TTS again instead of
+            # being served the fallback as a cache hit.
+            fallback_id = self._audio_key(text, f"gtts:{language}", "")
+            return await self._generate_with_gtts(
+                text,
+                language,
+                fallback_id,
+                self.audio_dir / f"{fallback_id}.mp3"
+            )
+    
+    async def _synthesize_segments(
+        self,
+        segments: list[str],
+        voice: str,
+        rate: str
+    ) -> bytes:
+        """Synthesize text segments concurrently and join the MP3 audio."""
+        semaphore = asyncio.Semaphore(TTS_MAX_PARALLEL_SEGMENTS)
+        
+        async def synthesize(segment: str) -> bytes:
+            async with semaphore:
+                communicate = edge_tts.Communicate(
+                    segment,
+                    voice,
+                    rate=rate,
+                    volume=self.default_volume
+                )
+                return b"".join([
+                    chunk["data"]
+                    async for chunk in communicate.stream()
+                    if chunk["type"] == "audio"
+                ])
+        
+        return b"".join(await asyncio.gather(*map(synthesize, segments)))
+    
+    def _remember_audio(self, audio_id: str, audio: bytes) -> None:
+        """Keep audio bytes in the in-memory LRU, evicting the oldest."""
+        if len(audio) > AUDIO_MEMORY_MAX_ITEM_BYTES:
+            return
+        
+        previous = self._audio_bytes.pop(audio_id, None)
+        if previous is not None:
+            self._audio_bytes_total -= len(previous)
+        
+        self._audio_bytes[audio_id] = audio
+        self._audio_bytes_total += len(audio)
+        while self._audio_bytes_total > AUDIO_MEMORY_CACHE_BYTES:
+            _, evicted = self._audio_bytes.popitem(last=False)
+            self._audio_bytes_total -= len(evicted)
+    
+    def _forget_audio(self, audio_id: str) -> None:
+        """Drop audio bytes from the in-memory LRU, if present."""
+        audio = self._audio_bytes.pop(audio_id, None)
+        if audio is not None:
+            self._audio_bytes_total -= len(audio)
+    
+    @staticmethod
+    def _audio_key(text: str, voice: str, rate: str) -> str:
+        """Derive the audio ID from the text and voice settings."""
+        return hashlib.blake2b(
+            f"{voice}|{rate}|{text}".encode(),
+            digest_size=12
+        ).hexdigest()
+    
+    @staticmethod
+    async def _audio_response(audio_id: str, output_file: Path) -> AudioResponse:
+        """Build the response for a generated audio file."""
+        duration = await asyncio.get_event_loop().run_in_executor(
+            None, _audio_duration, output_file
+        )
+        
+        return AudioResponse(
+            audio_id=audio_id,
+            audio_url=f"/api/audio/{audio_id}",
+            duration_seconds=duration,
+            format="mp3"
+        )
     
     async def _generate_with_gtts(
         self,
@@ -134,6 +255,14 @@ class SpeechService:
         output_file: Path
     ) -> AudioResponse:
         """Fallback to gTTS when Edge-TTS fails."""
+        try:
+            # Reuse fallback audio made during an earlier Edge-TTS failure
+            await _utime(output_file)
+            return await self._audio_response(audio_id, output_file)
+        except FileNotFoundError:
+            pass
+        
+        partial_file = None
         try:
             from gtts import gTTS
             import asyncio
@@ -146,28 +275,22 @@ class SpeechService:
             }
             gtts_lang = lang_map.get(language, language.split("-")[0] if "-" in language else language)
             
+            partial_file = output_file.with_suffix(f".{uuid.uuid4().hex}.part")
+            
             # Run gTTS in thread pool (it's synchronous)
             def generate():
                 tts = gTTS(text=text, lang=gtts_lang, slow=False)
-                tts.save(str(output_file))
+                tts.save(str(partial_file))
+                os.replace(partial_file, output_file)
             
             await asyncio.get_event_loop().run_in_executor(None, generate)
             
-            # Get file info
-            file_size = output_file.stat().st_size
-            estimated_duration = file_size / 16000
-            
-            return AudioResponse(
-                audio_id=audio_id,
-                audio_url=f"/api/audio/{audio_id}",
-                duration_seconds=round(estimated_duration, 2),
-                format="mp3"
-            )
+            return await self._audio_response(audio_id, output_file)
             
         except Exception as e:
-            logger.error(f"gTTS fallback also failed: {e}")
-            if output_file.exists():
-                output_file.unlink()
+            logger.error("gTTS fallback also failed: %s", e)
+            if partial_file is not None:
+                await _remove_if_exists(partial_file)
             raise APICallError(f"Audio generation failed: {str(e)}")
     
     async def generate_audio_stream(
@@ -193,7 +316,22 @@ class SpeechService:
             if chunk["type"] == "audio":
                 yield chunk["data"]
     
-    def get_audio_file(self, audio_id: str) -> Optional[Path]:
+    def get_audio_bytes(self, audio_id: str) -> Optional[bytes]:
+        """
+        Get recently generated audio from memory.
+        
+        Args:
+            audio_id: The audio file identifier
+        
+        Returns:
+            The MP3 data, or None if it is only available on disk
+        """
+        audio = self._audio_bytes.get(audio_id)
+        if audio is not None:
+            self._audio_bytes.move_to_end(audio_id)
+        return audio
+    
+    async def get_audio_file(self, audio_id: str) -> Optional[Path]:
         """
         Get the path to an audio file by ID.
         
@@ -204,11 +342,11 @@ class SpeechService:
             Path to the audio file, or None if not found
         """
         audio_file = self.audio_dir / f"{audio_id}.mp3"
-        if audio_file.exists():
+        if await aiofiles.os.path.isfile(audio_file):
             return audio_file
         return None
     
-    def delete_audio(self, audio_id: str) -> bool:
+    async def delete_audio(self, audio_id: str) -> bool:
         """
         Delete an audio file.
         
@@ -218,11 +356,12 @@ class SpeechService:
         Returns:
             True if deleted, False if not found
         """
+        self._forget_audio(audio_id)
         audio_file = self.audio_dir / f"{audio_id}.mp3"
-        if audio_file.exists():
-            audio_file.unlink()
-            return True
-        return False
+        if not await _remove_if_exists(audio_file):
+            return False
+        await _remove_if_exists(audio_file.with_suffix(".json"))
+        return True
     
     async def cleanup_old_files(self, max_age_hours: int = 24) -> int:
         """
@@ -234,50 +373,128 @@ class SpeechService:
         Returns:
             Number of files deleted
         """
-        import time
+        cutoff = time.time() - max_age_hours * 3600
         
-        deleted_count = 0
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
+        def sweep() -> list[str]:
+            # scandir entries carry their stat results, and the blocking
+            # stat/unlink calls stay off the event loop
+            deleted = []
+            with os.scandir(self.audio_dir) as entries:
+                for entry in entries:
+                    if (
+                        entry.name.endswith((".mp3", ".part"))
+                        and entry.stat().st_mtime < cutoff
+                    ):
+                        try:
+                            os.unlink(entry.path)
+                        except FileNotFoundError:
+                            continue
+                        if entry.name.endswith(".mp3"):
+                            # Drop the duration sidecar along with the audio
+                            Path(entry.path).with_suffix(".json").unlink(missing_ok=True)
+                            deleted.append(entry.name[:-len(".mp3")])
+            return deleted
         
-        for audio_file in self.audio_dir.glob("*.mp3"):
-            file_age = current_time - audio_file.stat().st_mtime
-            if file_age > max_age_seconds:
-                audio_file.unlink()
-                deleted_count += 1
+        deleted = await asyncio.get_event_loop().run_in_executor(None, sweep)
+        for audio_id in deleted:
+            self._forget_audio(audio_id)
+        deleted_count = len(deleted)
         
-        logger.info(f"Cleaned up {deleted_count} old audio files")
+        logger.info("Cleaned up %s old audio files", deleted_count)
         return deleted_count
     
     @staticmethod
-    async def list_available_voices() -> list[dict]:
+    async def list_available_voices(language: Optional[str] = None) -> list[dict]:
         """
-        List all available voices from Edge-TTS.
+        List available voices from Edge-TTS.
+        
+        The voice list is fetched once and reused for VOICE_LIST_TTL
+        seconds, indexed by language.
+        
+        Args:
+            language: Only return voices for this language code (optional)
         
         Returns:
             List of voice information dictionaries
         """
-        voices = await edge_tts.list_voices()
-        return [
-            {
-                "name": v["Name"],
-                "short_name": v["ShortName"],
-                "gender": v["Gender"],
-                "locale": v["Locale"],
-                "language": v["Locale"].split("-")[0]
-            }
-            for v in voices
-        ]
+        global _voices_cache
+        if _voices_cache is None or time.monotonic() - _voices_cache[0] >= VOICE_LIST_TTL:
+            async with _voices_lock:
+                if _voices_cache is None or time.monotonic() - _voices_cache[0] >= VOICE_LIST_TTL:
+                    voices = await edge_tts.list_voices()
+                    all_voices = [
+                        {
+                            "name": v["Name"],
+                            "short_name": v["ShortName"],
+                            "gender": v["Gender"],
+                            "locale": v["Locale"],
+                            "language": v["Locale"].split("-")[0]
+                        }
+                        for v in voices
+                    ]
+                    
+                    # None holds every voice
+                    by_lang: dict[Optional[str], list[dict]] = {None: all_voices}
+                    for voice in all_voices:
+                        by_lang.setdefault(voice["language"], []).append(voice)
+                    _voices_cache = (time.monotonic(), by_lang)
+        
+        return _voices_cache[1].get(language or None, [])
+
+
+async def _remove_if_exists(path: Path) -> bool:
+    """Delete a file without blocking, returning whether it existed."""
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
 
+def _split_segments(text: str) -> list[str]:
+    """Group the sentences of a text into segments of about TTS_SEGMENT_CHARS."""
+    if len(text) <= TTS_SEGMENT_CHARS:
+        return [text]
+    
+    segments = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        if current and len(current) + len(sentence) >= TTS_SEGMENT_CHARS:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
 
-# Singleton instance
-_service_instance: Optional[SpeechService] = None
+
+def _audio_duration(output_file: Path) -> float:
+    """
+    Get the duration of an MP3 file in seconds.
+    
+    The duration is read from the MP3 frame headers once and stored in a
+    JSON sidecar next to the file, so cached audio skips the parse.
+    """
+    sidecar = output_file.with_suffix(".json")
+    try:
+        return orjson.loads(sidecar.read_bytes())["duration_seconds"]
+    except (FileNotFoundError, orjson.JSONDecodeError, KeyError, TypeError):
+        pass
+    
+    try:
+        duration = MP3(output_file).info.length
+    except MutagenError as e:
+        # Rough estimate (~16KB per second) for files without readable headers
+        logger.warning("Could not read MP3 duration of %s: %s", output_file.name, e)
+        duration = output_file.stat().st_size / 16000
+    
+    duration = round(duration, 2)
+    sidecar.write_bytes(orjson.dumps({"duration_seconds": duration}))
+    return duration
 
 
+@cache
 def get_speech_service() -> SpeechService:
     """Get the singleton speech service instance."""
-    global _service_instance
-    if _service_instance is None:
-        settings = get_settings()
-        _service_instance = SpeechService(settings)
-    return _service_instance
+    return SpeechService(get_settings())
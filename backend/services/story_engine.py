@@ -3,10 +3,13 @@ Interactive Story Engine for generating age-appropriate educational stories.
 Uses AI to create engaging narratives aligned with curriculum concepts.
 """
 
+import asyncio
+import re
 import uuid
 import logging
-from typing import Optional
-from functools import lru_cache
+from typing import AsyncIterator, Optional
+from functools import cache, lru_cache
+from itertools import chain, islice
 
 from config import get_settings, Settings
 from models.schemas import (
@@ -14,11 +17,49 @@ from models.schemas import (
     ImageAnalysisResult, 
     QuizResponse
 )
-from models.curriculum import get_curriculum_kb
-from utils.retry import with_retry, APICallError
+from models.curriculum import get_curriculum_kb, KEYWORD_SEPARATORS
+from services.cache import get_cache_service, llm_cache_key
+from utils.http_client import get_http_client, get_llm_slots
+from utils.retry import with_retry, APICallError, provider_error
 
 logger = logging.getLogger(__name__)
 
+# System message sent with every OpenAI/Groq completion; the SDKs only
+# read it, so one dict is shared instead of built per call
+_STORY_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a creative children's story writer who creates engaging, educational stories. Your stories are fun, imaginative, and teach valuable lessons."
+}
+
+# TITLE/STORY/SUMMARY sections of a well-formed story response; the
+# markers may be wrapped in Markdown bold
+_STORY_RE = re.compile(
+    r"TITLE:\**[ \t]*(?P<title>[^\n]+)\s+\**STORY:\**\s*(?P<story>.+?)"
+    r"\s+\**SUMMARY:\**\s*(?P<summary>.+)",
+    re.DOTALL | re.IGNORECASE
+)
+
+# Fixed tail of the story prompt
+_STORY_PROMPT_GUIDELINES = """**Guidelines:**
+1. Create a fun, engaging narrative with relatable characters
+2. Naturally weave in educational concepts from the list above
+3. Include a clear beginning, middle, and end
+4. Add age-appropriate dialogue and descriptions
+5. End with a positive message or learning takeaway
+6. Make it interactive by asking the reader questions occasionally
+
+**Output Format:**
+Provide your response in this exact format:
+
+TITLE: [Creative, engaging title]
+
+STORY:
+[Full story content here]
+
+SUMMARY:
+[2-3 sentence summary of the story and its educational value]
+"""
+
 
 class StoryEngine:
     """
@@ -55,17 +96,27 @@ class StoryEngine:
         self.settings = settings
         self.provider = settings.ai_provider
         self.curriculum_kb = get_curriculum_kb()
+        # Story themes per suggested topic name, shared across requests
+        self._topic_themes = lru_cache(maxsize=256)(self._lookup_topic_themes)
+        # First three themes for a whole suggested_topics tuple
+        self._suggested_themes = lru_cache(maxsize=1024)(self._lookup_suggested_themes)
         self._init_client()
     
     def _init_client(self) -> None:
         """Initialize the AI client."""
         if self.provider == "openai":
             from openai import AsyncOpenAI
-            self.client = AsyncOpenAI(api_key=self.settings.openai_api_key)
+            self.client = AsyncOpenAI(
+                api_key=self.settings.openai_api_key,
+                http_client=get_http_client()
+            )
             self.model = "gpt-4o"
         elif self.provider == "groq":
             from groq import AsyncGroq
-            self.client = AsyncGroq(api_key=self.settings.groq_api_key)
+            self.client = AsyncGroq(
+                api_key=self.settings.groq_api_key,
+                http_client=get_http_client()
+            )
             self.model = "llama-3.3-70b-versatile"
         else:
             import google.generativeai as genai
@@ -73,6 +124,33 @@ class StoryEngine:
             self.client = genai.GenerativeModel("gemini-2.0-flash")
             self.model = "gemini-2.0-flash"
     
+    async def prewarm(self, keywords: str) -> None:
+        """
+        Prime the theme lookups a keyword story will need.
+        
+        Meant to run while the keywords are being analyzed, so building
+        the story prompt afterwards only hits cached curriculum themes.
+        The matching runs in a worker thread so it overlaps the provider
+        call instead of blocking the event loop.
+        """
+        await asyncio.to_thread(self._prime_topic_themes, keywords)
+    
+    def _prime_topic_themes(self, keywords: str) -> None:
+        """Look up the themes of the curriculum topics matching keywords."""
+        keyword_list = list(filter(None, KEYWORD_SEPARATORS.split(keywords.lower())))
+        for topic in self.curriculum_kb.find_matching_topics(keyword_list, max_results=3):
+            self._topic_themes(topic.name)
+    
+    def _lookup_topic_themes(self, topic_name: str) -> tuple[str, ...]:
+        """Get the story themes of the curriculum topic best matching a name."""
+        matching = self.curriculum_kb.find_matching_topics([topic_name], max_results=1)
+        return matching[0].story_themes if matching else ()
+    
+    def _lookup_suggested_themes(self, suggested_topics: tuple[str, ...]) -> tuple[str, ...]:
+        """Get the first three story themes across a list of suggested topics."""
+        themes = chain.from_iterable(map(self._topic_themes, suggested_topics))
+        return tuple(islice(themes, 3))
+    
     @with_retry(max_attempts=3)
     async def generate_story(
         self,
@@ -91,61 +169,156 @@ class StoryEngine:
         Returns:
             StoryResponse with generated story content
         """
-        story_id = str(uuid.uuid4())
-        age_settings = self.AGE_SETTINGS.get(age_group, self.AGE_SETTINGS["8-10"])
-        
         # Build the story prompt
-        prompt = self._build_story_prompt(analysis_result, age_settings, language)
+        prompt = self._build_story_prompt(analysis_result, age_group, language)
         
         try:
-            if self.provider == "openai":
-                story_data = await self._generate_with_openai(prompt)
-            elif self.provider == "groq":
-                story_data = await self._generate_with_groq(prompt)
-            else:
-                story_data = await self._generate_with_gemini(prompt)
+            # Identical prompts reuse the earlier completion
+            cache = get_cache_service()
+            cache_key = llm_cache_key(self.provider, self.model, "story", prompt)
+            cached = await cache.get(cache_key)
             
-            # Parse the response
-            title, content, summary = self._parse_story_response(story_data)
-            
-            # Count words
-            word_count = len(content.split())
+            if cached is not None:
+                story_data = cached.decode()
+            else:
+                async with get_llm_slots():
+                    if self.provider == "openai":
+                        story_data = await self._generate_with_openai(prompt)
+                    elif self.provider == "groq":
+                        story_data = await self._generate_with_groq(prompt)
+                    else:
+                        story_data = await self._generate_with_gemini(prompt)
+                await cache.set(
+                    cache_key,
+                    story_data.encode(),
+                    ttl=self.settings.llm_cache_ttl
+                )
             
-            return StoryResponse(
-                story_id=story_id,
-                title=title,
-                content=content,
-                summary=summary,
-                concepts_covered=analysis_result.educational_concepts[:5],
-                age_group=age_group,
-                word_count=word_count,
-                quiz=None,
-                audio_available=False
-            )
+            return self.build_story(story_data, analysis_result, age_group)
             
+        except APICallError as e:
+            logger.error("Story generation failed: %s", e)
+            raise
         except Exception as e:
-            logger.error(f"Story generation failed: {e}")
-            raise APICallError(f"Story generation failed: {str(e)}")
+            logger.error("Story generation failed: %s", e)
+            raise provider_error(
+                e, f"Story generation failed: {str(e)}", self.provider
+            ) from e
+    
+    async def stream_story(
+        self,
+        analysis_result: ImageAnalysisResult,
+        age_group: str = "8-10",
+        language: str = "en"
+    ) -> AsyncIterator[str]:
+        """
+        Generate a story and yield its text as the model produces it.
+        
+        The full text is cached once the stream completes, so a repeated
+        prompt is served as a single chunk. Pass the joined chunks to
+        build_story to get the parsed StoryResponse.
+        
+        Args:
+            analysis_result: Result from image/keyword analysis
+            age_group: Target age group
+            language: Language code
+        
+        Yields:
+            Pieces of the raw story response text
+        """
+        prompt = self._build_story_prompt(analysis_result, age_group, language)
+        
+        cache = get_cache_service()
+        cache_key = llm_cache_key(self.provider, self.model, "story", prompt)
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            yield cached.decode()
+            return
+        
+        if self.provider == "gemini":
+            chunks = self._stream_with_gemini(prompt)
+        else:
+            chunks = self._stream_with_chat_completions(prompt)
+        
+        parts = []
+        # The slot is held until the provider finishes streaming
+        async with get_llm_slots():
+            async for text in chunks:
+                parts.append(text)
+                yield text
+        
+        await cache.set(
+            cache_key,
+            "".join(parts).encode(),
+            ttl=self.settings.llm_cache_ttl
+        )
+    
+    def build_story(
+        self,
+        story_data: str,
+        analysis_result: ImageAnalysisResult,
+        age_group: str
+    ) -> StoryResponse:
+        """Build a StoryResponse from the raw story response text."""
+        title, content, summary = self._parse_story_response(story_data)
+        
+        # Count words
+        word_count = len(content.split())
+        
+        return StoryResponse(
+            story_id=str(uuid.uuid4()),
+            title=title,
+            content=content,
+            summary=summary,
+            concepts_covered=analysis_result.educational_concepts[:5],
+            age_group=age_group,
+            word_count=word_count,
+            quiz=None,
+            audio_available=False
+        )
+    
+    async def generate_stories(
+        self,
+        analyses: list[ImageAnalysisResult],
+        age_group: str = "8-10",
+        language: str = "en",
+        max_concurrency: Optional[int] = None
+    ) -> list[StoryResponse | BaseException]:
+        """
+        Generate stories for several analysis results concurrently.
+        
+        At most max_concurrency calls (default: the max_concurrent_llm
+        setting) are in flight at once. Results keep the order of analyses;
+        a failed analysis yields its exception instead of a story.
+        """
+        slots = asyncio.Semaphore(max_concurrency or self.settings.max_concurrent_llm)
+        
+        async def generate_one(analysis: ImageAnalysisResult) -> StoryResponse:
+            async with slots:
+                return await self.generate_story(analysis, age_group, language)
+        
+        return await asyncio.gather(
+            *(generate_one(analysis) for analysis in analyses),
+            return_exceptions=True
+        )
     
     def _build_story_prompt(
         self,
         analysis: ImageAnalysisResult,
-        age_settings: dict,
+        age_group: str,
         language: str
     ) -> str:
         """Build the prompt for story generation."""
-        min_words, max_words = age_settings["word_count"]
+        if age_group not in self.AGE_SETTINGS:
+            age_group = "8-10"
+        header, requirements = self._story_prompt_static(age_group, language)
         
         # Get story themes from curriculum
-        topic_themes = []
-        for topic_name in analysis.suggested_topics:
-            matching = self.curriculum_kb.find_matching_topics([topic_name], max_results=1)
-            if matching:
-                topic_themes.extend(matching[0].story_themes)
+        topic_themes = self._suggested_themes(tuple(analysis.suggested_topics))
         
-        themes = topic_themes[:3] if topic_themes else age_settings["themes"][:3]
+        themes = topic_themes if topic_themes else self.AGE_SETTINGS[age_group]["themes"][:3]
         
-        prompt = f"""Create an engaging educational story for children aged {age_settings['word_count']}.
+        return f"""{header}
 
 **Input Context:**
 - Scene/Topic: {analysis.scene_description}
@@ -153,43 +326,31 @@ class StoryEngine:
 - Educational Concepts to Include: {', '.join(analysis.educational_concepts[:3])}
 - Suggested Themes: {', '.join(themes)}
 
-**Story Requirements:**
+{requirements}"""
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _story_prompt_static(age_group: str, language: str) -> tuple[str, str]:
+        """Build the parts of the story prompt that only depend on age and language."""
+        age_settings = StoryEngine.AGE_SETTINGS[age_group]
+        min_words, max_words = age_settings["word_count"]
+        
+        header = f"Create an engaging educational story for children aged {age_group}."
+        requirements = f"""**Story Requirements:**
 - Length: {min_words}-{max_words} words
 - Vocabulary Level: {age_settings['vocabulary']}
 - Sentence Complexity: {age_settings['sentence_length']}
 - Language: {language}
 
-**Guidelines:**
-1. Create a fun, engaging narrative with relatable characters
-2. Naturally weave in educational concepts from the list above
-3. Include a clear beginning, middle, and end
-4. Add age-appropriate dialogue and descriptions
-5. End with a positive message or learning takeaway
-6. Make it interactive by asking the reader questions occasionally
-
-**Output Format:**
-Provide your response in this exact format:
-
-TITLE: [Creative, engaging title]
-
-STORY:
-[Full story content here]
-
-SUMMARY:
-[2-3 sentence summary of the story and its educational value]
-"""
-        
-        return prompt
+{_STORY_PROMPT_GUIDELINES}"""
+        return header, requirements
     
     async def _generate_with_openai(self, prompt: str) -> str:
         """Generate story using OpenAI."""
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are a creative children's story writer who creates engaging, educational stories. Your stories are fun, imaginative, and teach valuable lessons."
-                },
+                _STORY_SYSTEM_MESSAGE,
                 {"role": "user", "content": prompt}
             ],
             max_tokens=2000,
@@ -215,10 +376,7 @@ SUMMARY:
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are a creative children's story writer who creates engaging, educational stories. Your stories are fun, imaginative, and teach valuable lessons."
-                },
+                _STORY_SYSTEM_MESSAGE,
                 {"role": "user", "content": prompt}
             ],
             max_tokens=2000,
@@ -226,8 +384,49 @@ SUMMARY:
         )
         return response.choices[0].message.content
     
+    async def _stream_with_chat_completions(self, prompt: str) -> AsyncIterator[str]:
+        """Stream story text from OpenAI or Groq."""
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                _STORY_SYSTEM_MESSAGE,
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=2000,
+            temperature=0.8,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    async def _stream_with_gemini(self, prompt: str) -> AsyncIterator[str]:
+        """Stream story text from Google Gemini."""
+        import google.generativeai as genai
+        
+        response = await self.client.generate_content_async(
+            prompt,
+            generation_config=genai.GenerationConfig(
+                temperature=0.8,
+                max_output_tokens=2000
+            ),
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    
     def _parse_story_response(self, response: str) -> tuple[str, str, str]:
         """Parse the AI response into title, content, and summary."""
+        match = _STORY_RE.search(response)
+        if match:
+            return (
+                match.group("title").strip(),
+                match.group("story").strip(),
+                match.group("summary").strip()
+            )
+        
+        # Fall back to a line scan for loosely formatted responses
         title = "An Amazing Adventure"
         content = response
         summary = ""
@@ -283,14 +482,7 @@ SUMMARY:
         return story
 
 
-# Singleton instance
-_engine_instance: Optional[StoryEngine] = None
-
-
+@cache
 def get_story_engine() -> StoryEngine:
     """Get the singleton story engine instance."""
-    global _engine_instance
-    if _engine_instance is None:
-        settings = get_settings()
-        _engine_instance = StoryEngine(settings)
-    return _engine_instance
+    return StoryEngine(get_settings())
@@ -0,0 +1,96 @@
+"""Tests for how provider errors are classified and retried."""
+
+import asyncio
+import unittest
+
+import httpx
+
+from utils.retry import (
+    APICallError,
+    AuthenticationError,
+    BulkheadFullError,
+    RateLimitError,
+    provider_error,
+    with_retry,
+)
+
+
+class SDKError(Exception):
+    """Stand-in for a provider SDK error carrying an HTTP response."""
+    
+    def __init__(self, status_code: int, headers: dict | None = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = httpx.Response(status_code, headers=headers)
+
+
+def failing_call(exc: Exception):
+    """Build a retried call that always fails with a wrapped exc."""
+    calls = {"n": 0}
+    
+    @with_retry(max_attempts=3, min_wait=0.0, max_wait=0.01)
+    async def call():
+        calls["n"] += 1
+        try:
+            raise exc
+        except Exception as e:
+            raise provider_error(e, f"Call failed: {e}", "openai") from e
+    
+    return call, calls
+
+
+class ProviderErrorRetryTest(unittest.TestCase):
+    
+    def test_unauthorized_is_attempted_once(self):
+        call, calls = failing_call(SDKError(401))
+        with self.assertRaises(AuthenticationError) as ctx:
+            asyncio.run(call())
+        self.assertEqual(ctx.exception.status_code, 401)
+        self.assertEqual(calls["n"], 1)
+    
+    def test_bad_request_is_attempted_once(self):
+        call, calls = failing_call(SDKError(400))
+        with self.assertRaises(APICallError):
+            asyncio.run(call())
+        self.assertEqual(calls["n"], 1)
+    
+    def test_server_error_is_retried(self):
+        call, calls = failing_call(SDKError(503))
+        with self.assertRaises(APICallError):
+            asyncio.run(call())
+        self.assertEqual(calls["n"], 3)
+    
+    def test_rate_limit_keeps_retry_after(self):
+        error = provider_error(SDKError(429, {"retry-after": "0.05"}), "limited")
+        self.assertIsInstance(error, RateLimitError)
+        self.assertEqual(error.retry_after, 0.05)
+
+
+
+class BulkheadRetryTest(unittest.TestCase):
+    
+    def test_full_bulkhead_is_not_retried(self):
+        async def scenario():
+            bulkhead = asyncio.Semaphore(1)
+            await bulkhead.acquire()
+            
+            @with_retry(max_attempts=1, bulkhead=bulkhead)
+            async def guarded():
+                return "ok"
+            
+            calls = {"n": 0}
+            
+            @with_retry(max_attempts=3, min_wait=0.0, max_wait=0.01)
+            async def caller():
+                calls["n"] += 1
+                return await guarded()
+            
+            with self.assertRaises(BulkheadFullError):
+                await caller()
+            return calls["n"]
+        
+        self.assertEqual(asyncio.run(scenario()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
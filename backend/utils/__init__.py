@@ -1,5 +1,5 @@
 """Utility functions package."""
 
-from .retry import with_retry, RetryConfig
+from .retry import with_retry, RetryConfig, CircuitBreaker
 
-__all__ = ["with_retry", "RetryConfig"]
+__all__ = ["with_retry", "RetryConfig", "CircuitBreaker"]
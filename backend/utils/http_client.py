@@ -0,0 +1,42 @@
+"""
+Shared HTTP client for AI provider SDKs.
+Keeps one connection pool per process instead of one per SDK client, and
+one limit on in-flight provider calls shared by every service.
+"""
+
+import asyncio
+from functools import cache
+
+import httpx
+
+from config import get_settings
+
+# Pool sizing for concurrent LLM calls
+HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100)
+
+# Fail fast on connect; story completions can take a while to come back
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+
+@cache
+def get_http_client() -> httpx.AsyncClient:
+    """Get the process-wide async HTTP client (HTTP/2, pooled)."""
+    return httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+@cache
+def get_llm_slots() -> asyncio.Semaphore:
+    """
+    Get the process-wide cap on in-flight AI provider calls.
+    
+    Image analysis, story and quiz generation all hold a slot while they
+    wait on the provider, so bursts queue here instead of hitting 429s.
+    """
+    return asyncio.Semaphore(get_settings().max_concurrent_llm)
+
+
+async def close_http_client() -> None:
+    """Close the shared client if it was ever created."""
+    if get_http_client.cache_info().currsize:
+        await get_http_client().aclose()
+        get_http_client.cache_clear()
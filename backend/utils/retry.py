@@ -1,60 +1,432 @@
 """
 Retry logic utilities for robust API calls.
-Uses tenacity for exponential backoff and retry mechanisms.
+Uses tenacity for exponential backoff and retry mechanisms; it is imported
+when the first retry decorator is built rather than with this module.
 """
 
-from typing import TypeVar, Callable, Any
+from typing import TypeVar, Callable, Any, Hashable, Mapping
+from concurrent.futures import Future
 from dataclasses import dataclass
-from functools import wraps
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, partial, wraps
 import asyncio
 import logging
+import threading
+import time
 
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
-    before_sleep_log,
-    RetryError,
-)
+__all__ = [
+    "RETRYABLE_STATUS",
+    "DEFAULT_RETRYABLE",
+    "RetryConfig",
+    "create_retry_decorator",
+    "CircuitBreaker",
+    "with_retry",
+    "APICallError",
+    "RateLimitError",
+    "AuthenticationError",
+    "BulkheadFullError",
+    "parse_retry_after",
+    "provider_error",
+]
 
 logger = logging.getLogger(__name__)
 
 T = TypeVar("T")
 
+# HTTP statuses worth retrying; other 4xx responses will fail the same way again
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
 
-@dataclass
+
+class APICallError(Exception):
+    """Custom exception for API call failures."""
+    
+    def __init__(
+        self, 
+        message: str, 
+        status_code: int | None = None,
+        provider: str | None = None
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.provider = provider
+
+
+class RateLimitError(APICallError):
+    """
+    Exception for rate limit errors.
+    
+    retry_after is the delay in seconds the provider asked for, taken from
+    the response headers when only those are given.
+    """
+    
+    def __init__(
+        self,
+        message: str,
+        status_code: int | None = None,
+        provider: str | None = None,
+        retry_after: float | None = None,
+        headers: Mapping[str, str] | None = None
+    ):
+        super().__init__(message, status_code, provider)
+        if retry_after is None and headers is not None:
+            retry_after = parse_retry_after(headers)
+        self.retry_after = retry_after
+
+
+class AuthenticationError(APICallError):
+    """Exception for authentication errors."""
+    pass
+
+
+class BulkheadFullError(APICallError):
+    """
+    Exception for calls rejected because their bulkhead stayed full.
+    
+    Never retried: retrying would only queue more work on the saturated
+    upstream the bulkhead is protecting.
+    """
+    pass
+
+
+# Transient failures retried by default; programming errors such as
+# KeyError or TypeError surface at once instead of being retried
+DEFAULT_RETRYABLE = (APICallError, asyncio.TimeoutError, ConnectionError, OSError)
+
+
+@dataclass(slots=True, frozen=True)
 class RetryConfig:
-    """Configuration for retry behavior."""
+    """Configuration for retry behavior; immutable and hashable."""
     
     max_attempts: int = 3
     min_wait_seconds: float = 1.0
     max_wait_seconds: float = 10.0
+    # Scales exponential_base ** (attempt - 1); min/max_wait clamp the result
+    multiplier: float = 1.0
     exponential_base: float = 2.0
-    retry_exceptions: tuple = (Exception,)
+    jitter_seconds: float = 1.0
+    retry_exceptions: tuple = DEFAULT_RETRYABLE
+    # Stop retrying once this many seconds have passed since the first attempt
+    total_deadline_seconds: float | None = None
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Tell transient failures from permanent ones such as bad credentials."""
+    if isinstance(exc, (AuthenticationError, BulkheadFullError)):
+        return False
+    if isinstance(exc, RateLimitError):
+        return True
+    if isinstance(exc, APICallError) and exc.status_code is not None:
+        return exc.status_code in RETRYABLE_STATUS
+    return True
+
+
+def _flatten_exception_types(types: tuple) -> tuple[type[BaseException], ...]:
+    """Flatten nested tuples of exception types, dropping duplicates."""
+    flat = []
+    for exc_type in types:
+        if isinstance(exc_type, tuple):
+            flat.extend(_flatten_exception_types(exc_type))
+        else:
+            flat.append(exc_type)
+    return tuple(dict.fromkeys(flat))
+
+
+def _log_exhausted(
+    retry_state,
+    fname: str | None = None,
+    metrics: Callable[[str, str], None] | None = None,
+) -> Any:
+    """Log a call that used up its attempts, then re-raise its last error."""
+    exc = retry_state.outcome.exception()
+    if fname is None:
+        fname = retry_state.fn.__name__
+    if metrics is not None:
+        metrics(fname, "exhausted")
+    # The callback runs outside any except block, so hand the exception
+    # itself to the logger for its traceback
+    logger.error(
+        "All retry attempts failed for %s: %s",
+        fname, exc, exc_info=exc,
+    )
+    raise exc
 
 
 def create_retry_decorator(config: RetryConfig):
     """Create a tenacity retry decorator with the given config."""
+    from tenacity import (
+        retry,
+        stop_after_attempt,
+        stop_after_delay,
+        wait_exponential,
+        wait_random,
+        retry_if_exception,
+        before_sleep_log,
+    )
+    
+    # Random jitter keeps concurrent callers from retrying in lockstep
+    backoff = wait_exponential(
+        multiplier=config.multiplier,
+        min=config.min_wait_seconds,
+        max=config.max_wait_seconds,
+        exp_base=config.exponential_base,
+    ) + wait_random(0, config.jitter_seconds)
+    
+    def wait(retry_state) -> float:
+        # Wait as long as a rate-limiting provider asked, capped at
+        # max_wait so a long Retry-After cannot stall the request
+        exc = retry_state.outcome.exception()
+        if isinstance(exc, RateLimitError) and exc.retry_after is not None:
+            return min(exc.retry_after, config.max_wait_seconds)
+        return min(backoff(retry_state), config.max_wait_seconds)
+    
+    # One flat tuple means a single isinstance call per raised exception
+    retry_types = _flatten_exception_types(config.retry_exceptions)
+    
+    def should_retry(exc: BaseException) -> bool:
+        return isinstance(exc, retry_types) and _is_retryable(exc)
+    
+    stop = stop_after_attempt(config.max_attempts)
+    if config.total_deadline_seconds is not None:
+        stop = stop | stop_after_delay(config.total_deadline_seconds)
+    
     return retry(
-        stop=stop_after_attempt(config.max_attempts),
-        wait=wait_exponential(
-            multiplier=config.min_wait_seconds,
-            min=config.min_wait_seconds,
-            max=config.max_wait_seconds,
-            exp_base=config.exponential_base,
-        ),
-        retry=retry_if_exception_type(config.retry_exceptions),
+        stop=stop,
+        wait=wait,
+        retry=retry_if_exception(should_retry),
         before_sleep=before_sleep_log(logger, logging.WARNING),
+        retry_error_callback=_log_exhausted,
         reraise=True,
     )
 
 
+@lru_cache(maxsize=128)
+def _get_retry_decorator(
+    max_attempts: int,
+    min_wait: float,
+    max_wait: float,
+    exceptions: tuple,
+    total_deadline: float | None,
+):
+    """Build the tenacity decorator for a set of retry options, once."""
+    return create_retry_decorator(RetryConfig(
+        max_attempts=max_attempts,
+        min_wait_seconds=min_wait,
+        max_wait_seconds=max_wait,
+        retry_exceptions=exceptions,
+        total_deadline_seconds=total_deadline,
+    ))
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while an upstream service is down.
+    
+    After failure_threshold consecutive failed calls the breaker opens and
+    rejects calls with APICallError for reset_timeout seconds. It then lets
+    a single probe call through (half-open): success closes the breaker,
+    failure opens it again. A probe that has not finished within
+    reset_timeout does not block the next one.
+    
+    Usage:
+        openai_breaker = CircuitBreaker("openai")
+        
+        @with_retry(max_attempts=3, circuit_breaker=openai_breaker)
+        async def call_api():
+            ...
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(
+        self,
+        provider: str | None = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at = 0.0
+    
+    def allow(self) -> bool:
+        """Check whether a call may go ahead."""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        self.state = self.HALF_OPEN
+        self.opened_at = now
+        return True
+    
+    def record_success(self) -> None:
+        """Close the breaker after a successful call."""
+        self.state = self.CLOSED
+        self.failure_count = 0
+    
+    def record_failure(self) -> None:
+        """Count a failed call, opening the breaker at the threshold."""
+        self.failure_count += 1
+        if self.state == self.HALF_OPEN or self.failure_count >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+    
+    def wrap(self, func: Callable[..., T]) -> Callable[..., T]:
+        """Guard a sync or async function with this breaker."""
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_guarded(*args, **kwargs) -> T:
+                self._check()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    self.record_failure()
+                    raise
+                self.record_success()
+                return result
+            
+            return async_guarded
+        
+        @wraps(func)
+        def sync_guarded(*args, **kwargs) -> T:
+            self._check()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self.record_failure()
+                raise
+            self.record_success()
+            return result
+        
+        return sync_guarded
+    
+    def _check(self) -> None:
+        """Raise APICallError if the breaker rejects the call."""
+        if not self.allow():
+            raise APICallError(
+                f"Circuit open for {self.provider or 'upstream'}; failing fast",
+                provider=self.provider
+            )
+
+
+def _bulkheaded(
+    func: Callable[..., T],
+    bulkhead: asyncio.Semaphore,
+    timeout: float
+) -> Callable[..., T]:
+    """Run an async function only while holding a bulkhead slot."""
+    if not asyncio.iscoroutinefunction(func):
+        raise TypeError("bulkhead is only supported for async functions")
+    
+    @wraps(func)
+    async def async_bulkheaded(*args, **kwargs) -> T:
+        if bulkhead.locked():
+            try:
+                if timeout <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(bulkhead.acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise BulkheadFullError(
+                    "Too many concurrent calls; bulkhead is full",
+                    status_code=503
+                ) from None
+        else:
+            await bulkhead.acquire()
+        
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            bulkhead.release()
+    
+    return async_bulkheaded
+
+
+def _single_flight(
+    func: Callable[..., T],
+    key_func: Callable[..., Hashable]
+) -> Callable[..., T]:
+    """
+    Coalesce concurrent calls with the same key into one call.
+    
+    The first caller for a key runs func; callers arriving while it is in
+    flight wait for and share its result or exception.
+    """
+    if asyncio.iscoroutinefunction(func):
+        pending: dict[Hashable, asyncio.Future] = {}
+        
+        @wraps(func)
+        async def async_single_flight(*args, **kwargs) -> T:
+            key = key_func(*args, **kwargs)
+            future = pending.get(key)
+            if future is not None:
+                # Shielded so a cancelled follower does not cancel the call
+                return await asyncio.shield(future)
+            
+            future = asyncio.get_running_loop().create_future()
+            pending[key] = future
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                # Mark it retrieved in case no follower was waiting
+                future.exception()
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                del pending[key]
+        
+        return async_single_flight
+    
+    lock = threading.Lock()
+    running: dict[Hashable, Future] = {}
+    
+    @wraps(func)
+    def sync_single_flight(*args, **kwargs) -> T:
+        key = key_func(*args, **kwargs)
+        with lock:
+            future = running.get(key)
+            leader = future is None
+            if leader:
+                future = running[key] = Future()
+        if not leader:
+            return future.result()
+        
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with lock:
+                del running[key]
+    
+    return sync_single_flight
+
+
 def with_retry(
     max_attempts: int = 3,
     min_wait: float = 1.0,
     max_wait: float = 10.0,
-    exceptions: tuple = (Exception,),
+    exceptions: tuple = DEFAULT_RETRYABLE,
+    total_deadline: float | None = None,
+    circuit_breaker: CircuitBreaker | None = None,
+    single_flight_key: Callable[..., Hashable] | None = None,
+    bulkhead: asyncio.Semaphore | None = None,
+    bulkhead_timeout: float = 0.0,
+    strict_sync: bool = False,
+    metrics: Callable[[str, str], None] | None = None,
 ):
     """
     Decorator for adding retry logic to async functions.
@@ -63,72 +435,160 @@ def with_retry(
         max_attempts: Maximum number of retry attempts
         min_wait: Minimum wait time between retries (seconds)
         max_wait: Maximum wait time between retries (seconds)
-        exceptions: Tuple of exceptions to retry on
+        exceptions: Tuple of exceptions to retry on; defaults to
+            DEFAULT_RETRYABLE, so programming errors are not retried
+        total_deadline: Stop retrying once this many seconds have passed
+            since the first attempt (optional)
+        circuit_breaker: Breaker that fails calls fast once the retried
+            call keeps failing (optional)
+        single_flight_key: Maps call arguments to a key; concurrent calls
+            with the same key share one retried call and its result
+            (optional)
+        bulkhead: Semaphore capping concurrent calls to an upstream,
+            retries included; size it to fit the shared HTTP client's
+            connection limits (async functions only, optional)
+        bulkhead_timeout: Seconds to wait for a bulkhead slot before
+            failing with BulkheadFullError; 0 fails at once when it is full
+        strict_sync: Make a sync function raise RuntimeError when called
+            from inside a running event loop, where its retry sleeps would
+            block the loop (sync functions only)
+        metrics: Called with the function name and "retry" before each
+            retry sleep, or "exhausted" once all attempts have failed, e.g.
+            to increment a counter labelled by function and outcome
+            (optional)
     
     Usage:
         @with_retry(max_attempts=3, exceptions=(APIError,))
         async def call_api():
             ...
     """
-    config = RetryConfig(
-        max_attempts=max_attempts,
-        min_wait_seconds=min_wait,
-        max_wait_seconds=max_wait,
-        retry_exceptions=exceptions,
-    )
-    retry_decorator = create_retry_decorator(config)
+    # A single attempt has nothing to retry, so tenacity is skipped
+    retry_decorator = None
+    if max_attempts > 1:
+        retry_decorator = _get_retry_decorator(
+            max_attempts, min_wait, max_wait, exceptions, total_deadline
+        )
     
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
-        @wraps(func)
-        async def async_wrapper(*args, **kwargs) -> T:
-            @retry_decorator
-            async def inner():
-                return await func(*args, **kwargs)
+        fname = func.__name__
+        retried = func
+        if retry_decorator is not None:
+            # Wrap once here; tenacity picks the async or sync retrying loop.
+            # The function's name is bound into its callbacks now rather
+            # than looked up on every failure.
+            retried = retry_decorator(func)
+            callbacks = {
+                "retry_error_callback": partial(
+                    _log_exhausted, fname=fname, metrics=metrics
+                ),
+            }
+            if metrics is not None:
+                log_before_sleep = retried.retry.before_sleep
+                
+                def before_sleep(retry_state) -> None:
+                    log_before_sleep(retry_state)
+                    metrics(fname, "retry")
+                
+                callbacks["before_sleep"] = before_sleep
+            retried = retried.retry_with(**callbacks)
+        if circuit_breaker is not None:
+            # One guarded call covers all of its retry attempts
+            retried = circuit_breaker.wrap(retried)
+        if bulkhead is not None:
+            retried = _bulkheaded(retried, bulkhead, bulkhead_timeout)
+        if single_flight_key is not None:
+            retried = _single_flight(retried, single_flight_key)
+        if retried is func:
+            # Nothing to add around the call
+            return func
+        
+        # Only the wrapper matching the function's kind is built
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs) -> T:
+                return await retried(*args, **kwargs)
             
-            try:
-                return await inner()
-            except RetryError as e:
-                logger.error(f"All retry attempts failed for {func.__name__}: {e}")
-                raise e.last_attempt.exception()
+            return async_wrapper
+        
+        if strict_sync:
+            @wraps(func)
+            def strict_sync_wrapper(*args, **kwargs) -> T:
+                # Retry sleeps would block the loop's thread for the whole
+                # backoff, so make the caller use an async function instead
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    return retried(*args, **kwargs)
+                raise RuntimeError(
+                    f"{fname} uses sync with_retry inside a running "
+                    "event loop; use an async function instead"
+                )
+            
+            return strict_sync_wrapper
         
         @wraps(func)
         def sync_wrapper(*args, **kwargs) -> T:
-            @retry_decorator
-            def inner():
-                return func(*args, **kwargs)
-            
-            try:
-                return inner()
-            except RetryError as e:
-                logger.error(f"All retry attempts failed for {func.__name__}: {e}")
-                raise e.last_attempt.exception()
+            return retried(*args, **kwargs)
         
-        if asyncio.iscoroutinefunction(func):
-            return async_wrapper
         return sync_wrapper
     
     return decorator
 
 
-class APICallError(Exception):
-    """Custom exception for API call failures."""
+def parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    """
+    Read the retry delay from rate-limit response headers, in seconds.
     
-    def __init__(
-        self, 
-        message: str, 
-        status_code: int | None = None,
-        provider: str | None = None
-    ):
-        super().__init__(message)
-        self.status_code = status_code
-        self.provider = provider
-
-
-class RateLimitError(APICallError):
-    """Exception for rate limit errors."""
-    pass
+    Understands retry-after-ms, and retry-after as either seconds or an
+    HTTP date. Returns None when neither header is usable.
+    """
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
 
 
-class AuthenticationError(APICallError):
-    """Exception for authentication errors."""
-    pass
+def provider_error(
+    exc: Exception,
+    message: str,
+    provider: str | None = None
+) -> APICallError:
+    """
+    Wrap a provider SDK error as an APICallError, keeping its HTTP status.
+    
+    401 and 403 become AuthenticationError and 429 becomes RateLimitError
+    carrying the response's Retry-After, so the retry classifier can tell
+    permanent failures from transient ones.
+    """
+    response = getattr(exc, "response", None)
+    status_code = getattr(exc, "status_code", None)
+    if not isinstance(status_code, int):
+        status_code = getattr(response, "status_code", None)
+    if not isinstance(status_code, int):
+        status_code = None
+    
+    if status_code in (401, 403):
+        return AuthenticationError(message, status_code, provider)
+    if status_code == 429:
+        return RateLimitError(
+            message,
+            status_code,
+            provider,
+            headers=getattr(response, "headers", None)
+        )
+    return APICallError(message, status_code, provider)